@@ -1,12 +1,15 @@
 import os
 import logging
 import boto3
+from s3_purge import purge_prefix
+from structured_logging import log
 
 logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger()
 
 def lambda_handler(event: dict, context: dict) -> dict:
     if event:
-        logging.info(f"Event: {event}")
+        log(logger, logging.INFO, "Event", event=event)
         try:
             logging.info("Deleting files")            
         except Exception as error:
@@ -15,13 +18,10 @@ def lambda_handler(event: dict, context: dict) -> dict:
     else:
         logging.info("No event found")
         
-def delete_intermediate_files(file_key: str) -> None:
+def delete_intermediate_files(file_key: str, dry_run: bool = False) -> dict:
+    """Deletes every intermediate file under the prefix"""
     try:
-        s3_client = boto3.client("s3")
-        objects_to_be_delete = s3_client.list_objects(Bucket=os.environ["bucket_name"], Prefix=file_key)
-        delete_keys = {"Objects": []}
-        delete_keys["Objects"] = [{"Key": k} for k in [obj["Key"] for obj in objects_to_be_delete.get("Contents", [])]]
-        s3_client.delete_object(Bucket=os.environ["bucket_name"], Key=delete_keys)
+        return purge_prefix(os.environ["bucket_name"], file_key, dry_run=dry_run)
     except Exception as error:
         logging.error(error)
         raise error
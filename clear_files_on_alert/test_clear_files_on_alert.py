@@ -0,0 +1,19 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common", "python"))
+from clear_files_on_alert import delete_intermediate_files
+
+class TestClearFilesOnAlert(unittest.TestCase):
+
+    @patch.dict('os.environ', {'bucket_name': 'test-bucket'})
+    @patch('clear_files_on_alert.purge_prefix')
+    def test_delete_intermediate_files(self, mock_purge_prefix):
+        mock_purge_prefix.return_value = {'objects': 3, 'bytes': 30}
+        report = delete_intermediate_files('processing/')
+        mock_purge_prefix.assert_called_once_with('test-bucket', 'processing/', dry_run=False)
+        self.assertEqual(report['objects'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
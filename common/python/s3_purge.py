@@ -0,0 +1,86 @@
+"""Batched, parallel deletion of everything under an S3 prefix.
+
+Shipped to the Lambdas in the common layer (constructs/lambda_layer_construct.py)
+so every cleanup path shares one engine: listings are paginated, keys are
+deleted 1000 at a time with delete_objects, batches run concurrently and keys
+S3 reports as failed are retried.
+"""
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import boto3
+
+logging.getLogger().setLevel(logging.INFO)
+
+DELETE_BATCH_SIZE = 1000
+MAX_WORKERS = 8
+MAX_ATTEMPTS = 4
+
+
+def delete_batch(
+    s3,
+    bucket_name: str,
+    keys: List[str],
+    max_attempts: int = MAX_ATTEMPTS
+) -> List[str]:
+    """Deletes up to 1000 keys, retrying the ones S3 reports as errors. Returns keys that still failed."""
+    remaining = keys
+    for attempt in range(max_attempts):
+        if attempt:
+            time.sleep(0.2 * 2 ** attempt)
+        response = s3.delete_objects(
+            Bucket=bucket_name,
+            Delete={"Objects": [{"Key": key} for key in remaining], "Quiet": True}
+        )
+        remaining = [error["Key"] for error in response.get("Errors", [])]
+        if not remaining:
+            break
+        logging.warning("%s keys failed to delete on attempt %s", len(remaining), attempt + 1)
+    return remaining
+
+
+def purge_prefix(
+    bucket_name: str,
+    prefix: str,
+    dry_run: bool = False,
+    max_workers: int = MAX_WORKERS,
+    s3=None
+) -> Dict[str, float]:
+    """Deletes every object under prefix and returns how many objects and bytes went, and how fast."""
+    s3 = s3 or boto3.client("s3")
+    start = time.time()
+    sizes = {}
+    futures = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        batch = []
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket_name, Prefix=prefix):
+            for obj in page.get("Contents", []):
+                sizes[obj["Key"]] = obj.get("Size", 0)
+                batch.append(obj["Key"])
+                if len(batch) == DELETE_BATCH_SIZE:
+                    if not dry_run:
+                        futures.append(executor.submit(delete_batch, s3, bucket_name, batch))
+                    batch = []
+        if batch and not dry_run:
+            futures.append(executor.submit(delete_batch, s3, bucket_name, batch))
+        failed = {key for future in futures for key in future.result()}
+
+    elapsed = max(time.time() - start, 1e-6)
+    deleted = [key for key in sizes if key not in failed]
+    report = {
+        "objects": len(deleted),
+        "bytes": sum(sizes[key] for key in deleted),
+        "seconds": elapsed,
+    }
+    report["objects_per_second"] = report["objects"] / elapsed
+    report["bytes_per_second"] = report["bytes"] / elapsed
+    logging.info(
+        "%s %s objects (%s bytes) under s3://%s/%s in %.2fs: %.0f objects/s, %.0f bytes/s",
+        "Would delete" if dry_run else "Deleted", report["objects"], report["bytes"],
+        bucket_name, prefix, elapsed, report["objects_per_second"], report["bytes_per_second"]
+    )
+    if failed:
+        logging.error("Failed to delete %s objects under %s: %s", len(failed), prefix, sorted(failed)[:10])
+        raise OSError(f"Failed to delete {len(failed)} objects under {prefix}")
+    return report
@@ -0,0 +1,81 @@
+"""Cheap structured logging shared by the Lambdas through the common layer.
+
+log() emits one JSON line per call, but only builds it when a handler actually
+formats the record: calls below the logger's level, or dropped by sampling,
+cost a level check. Values are summarized instead of stringified (DataFrames
+by shape and dtypes, long collections by length, long strings truncated) and
+anything that looks like a secret is redacted.
+"""
+import re
+import json
+import random
+import logging
+from typing import Any
+
+MAX_ITEMS = 20
+MAX_CHARS = 500
+MAX_DEPTH = 3
+REDACTED = "***"
+
+# Field names whose values are never logged
+SECRET_KEY_PATTERN = re.compile(
+    r"secret|passw|token|private_?key|privatekey|credential|authorization|api_?key|access_?key",
+    re.IGNORECASE
+)
+# Signed URL query parameters that grant access on their own
+SIGNED_URL_PATTERN = re.compile(r"(X-Amz-(?:Signature|Credential|Security-Token)=)[^&\s\"']+", re.IGNORECASE)
+
+
+def summarize(value: Any, depth: int = 0) -> Any:
+    """Returns a small, JSON-friendly stand-in for value."""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        value = SIGNED_URL_PATTERN.sub(rf"\g<1>{REDACTED}", value)
+        return value if len(value) <= MAX_CHARS else f"{value[:MAX_CHARS]}... ({len(value)} chars)"
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    if hasattr(value, "shape") and hasattr(value, "dtypes"):
+        # pandas DataFrame, checked by shape so pandas is never imported here
+        dtypes = value.dtypes
+        return {
+            "type": type(value).__name__,
+            "shape": list(value.shape),
+            "dtypes": {str(col): str(dtype) for col, dtype in list(dtypes.items())[:MAX_ITEMS]}
+                      if hasattr(dtypes, "items") else str(dtypes),
+        }
+    if isinstance(value, dict):
+        if depth >= MAX_DEPTH or len(value) > MAX_ITEMS:
+            return {"type": "dict", "len": len(value), "keys": [str(key) for key in list(value)[:MAX_ITEMS]]}
+        return {
+            str(key): REDACTED if SECRET_KEY_PATTERN.search(str(key)) else summarize(item, depth + 1)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple, set, frozenset)):
+        if depth >= MAX_DEPTH or len(value) > MAX_ITEMS:
+            return {"type": type(value).__name__, "len": len(value)}
+        return [summarize(item, depth + 1) for item in value]
+    return f"<{type(value).__name__}>"
+
+
+class StructuredMessage:
+    """Log message whose JSON body is only built when a handler formats the record."""
+
+    def __init__(self, message: str, fields: dict):
+        self.message = message
+        self.fields = fields
+
+    def __str__(self) -> str:
+        body = {"message": self.message}
+        for key, value in self.fields.items():
+            body[key] = REDACTED if SECRET_KEY_PATTERN.search(key) else summarize(value)
+        return json.dumps(body, default=str)
+
+
+def log(logger: logging.Logger, level: int, message: str, sample_rate: float = 1.0, **fields) -> None:
+    """Logs message with fields as one JSON line, keeping only sample_rate of the calls."""
+    if not logger.isEnabledFor(level):
+        return
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    logger.log(level, StructuredMessage(message, fields), stacklevel=2)
@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+from unittest.mock import patch, Mock
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "python"))
+from s3_purge import delete_batch, purge_prefix
+
+class TestS3Purge(unittest.TestCase):
+
+    def setUp(self):
+        self.mock_s3 = Mock()
+        self.pages = [
+            {'Contents': [{'Key': f'prefix/{i}', 'Size': 10} for i in range(1000)]},
+            {'Contents': [{'Key': f'prefix/{i}', 'Size': 10} for i in range(1000, 1500)]},
+        ]
+        self.mock_s3.get_paginator.return_value.paginate.return_value = self.pages
+        self.mock_s3.delete_objects.return_value = {}
+
+    def test_purge_prefix_deletes_in_batches(self):
+        report = purge_prefix('test-bucket', 'prefix/', s3=self.mock_s3)
+
+        self.mock_s3.get_paginator.return_value.paginate.assert_called_once_with(Bucket='test-bucket', Prefix='prefix/')
+        batch_sizes = sorted(len(kwargs['Delete']['Objects']) for _, kwargs in self.mock_s3.delete_objects.call_args_list)
+        self.assertEqual(batch_sizes, [500, 1000])
+        self.assertEqual(report['objects'], 1500)
+        self.assertEqual(report['bytes'], 15000)
+
+    def test_purge_prefix_dry_run_deletes_nothing(self):
+        report = purge_prefix('test-bucket', 'prefix/', dry_run=True, s3=self.mock_s3)
+
+        self.mock_s3.delete_objects.assert_not_called()
+        self.assertEqual(report['objects'], 1500)
+
+    @patch('s3_purge.time.sleep')
+    def test_delete_batch_retries_errored_keys(self, mock_sleep):
+        self.mock_s3.delete_objects.side_effect = [{'Errors': [{'Key': 'b', 'Code': 'SlowDown'}]}, {}]
+
+        remaining = delete_batch(self.mock_s3, 'test-bucket', ['a', 'b'])
+
+        self.assertEqual(remaining, [])
+        retried = self.mock_s3.delete_objects.call_args_list[1][1]['Delete']['Objects']
+        self.assertEqual(retried, [{'Key': 'b'}])
+
+    @patch('s3_purge.time.sleep')
+    def test_purge_prefix_raises_when_keys_remain(self, mock_sleep):
+        self.mock_s3.delete_objects.return_value = {'Errors': [{'Key': 'prefix/0', 'Code': 'AccessDenied'}]}
+
+        with self.assertRaises(OSError):
+            purge_prefix('test-bucket', 'prefix/', s3=self.mock_s3)
+
+if __name__ == '__main__':
+    unittest.main()
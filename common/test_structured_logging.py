@@ -0,0 +1,48 @@
+import os
+import sys
+import json
+import logging
+import unittest
+from unittest.mock import patch
+import pandas as pd
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "python"))
+from structured_logging import log, summarize, StructuredMessage
+
+class TestStructuredLogging(unittest.TestCase):
+
+    def test_summarize_large_objects(self):
+        df = pd.DataFrame({'a': range(1000), 'b': ['x'] * 1000})
+        self.assertEqual(summarize(df), {"type": "DataFrame", "shape": [1000, 2], "dtypes": {"a": "int64", "b": str(df.dtypes['b'])}})
+        self.assertEqual(summarize(list(range(100))), {"type": "list", "len": 100})
+        self.assertEqual(summarize([1, "a"]), [1, "a"])
+        self.assertTrue(summarize("x" * 1000).endswith("... (1000 chars)"))
+        self.assertEqual(summarize(b"abc"), "<bytes len=3>")
+
+    def test_secrets_are_redacted(self):
+        summary = summarize({"user": "loader", "privateKey": "-----BEGIN", "nested": {"SecretString": "{}"}})
+        self.assertEqual(summary, {"user": "loader", "privateKey": "***", "nested": {"SecretString": "***"}})
+        url = "https://b.s3.amazonaws.com/k.xlsx?X-Amz-Credential=AKIA%2F1&X-Amz-Signature=abc123&X-Amz-Expires=60"
+        self.assertEqual(summarize(url), "https://b.s3.amazonaws.com/k.xlsx?X-Amz-Credential=***&X-Amz-Signature=***&X-Amz-Expires=60")
+        self.assertEqual(json.loads(str(StructuredMessage("m", {"token": "t"})))["token"], "***")
+
+    def test_log_is_lazy_and_gated(self):
+        logger = logging.getLogger("test_structured_logging")
+        logger.setLevel(logging.INFO)
+        with patch('structured_logging.summarize') as mock_summarize:
+            log(logger, logging.DEBUG, "Skipped", frame=object())
+            mock_summarize.assert_not_called()
+        with self.assertLogs(logger, level="INFO") as captured:
+            log(logger, logging.INFO, "Loaded", rows=10, records=list(range(50)))
+        self.assertEqual(json.loads(captured.records[0].getMessage()), {"message": "Loaded", "rows": 10, "records": {"type": "list", "len": 50}})
+
+    @patch('structured_logging.random.random', return_value=0.5)
+    def test_log_sampling(self, mock_random):
+        logger = logging.getLogger("test_structured_logging")
+        logger.setLevel(logging.INFO)
+        with self.assertLogs(logger, level="INFO") as captured:
+            log(logger, logging.INFO, "Dropped", sample_rate=0.1)
+            log(logger, logging.INFO, "Kept", sample_rate=0.9)
+        self.assertEqual([json.loads(record.getMessage())["message"] for record in captured.records], ["Kept"])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os
+import aws_cdk.aws_lambda as lambda_
+from aws_cdk import Stack
+
+# Lambda only puts /opt/python on sys.path, so the layer's modules live in common/python
+COMMON_LAYER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "common")
+
+
+class LambdaLayerConstruct:
+    """Class for methods to create the Lambda layers."""
+
+    @staticmethod
+    def create_common_layer(
+        stack: Stack,
+        env: str,
+        config: dict
+    ) -> lambda_.LayerVersion:
+        """Creates the layer with the modules shared by the Lambdas."""
+        return lambda_.LayerVersion(
+            scope=stack,
+            id=f"{config[env]['appName']}-common-layer-Id",
+            layer_version_name=f"{config[env]['appName']}-common",
+            code=lambda_.Code.from_asset(COMMON_LAYER_PATH, exclude=["test_*", "**/__pycache__"]),
+            compatible_runtimes=[
+                lambda_.Runtime.PYTHON_3_9,
+                lambda_.Runtime.PYTHON_3_10,
+                lambda_.Runtime.PYTHON_3_11,
+                lambda_.Runtime.PYTHON_3_12
+            ],
+            description=f"{config[env]['appName']} modules shared by the Lambdas"
+        )
+
+    @staticmethod
+    def attach_common_layer(
+        functions: list,
+        layer: lambda_.LayerVersion
+    ) -> None:
+        """Adds the common layer to every Lambda that imports from it."""
+        for function in functions:
+            function.add_layers(layer)
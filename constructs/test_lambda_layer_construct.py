@@ -0,0 +1,42 @@
+from unittest.mock import patch, Mock
+from aws_cdk.aws_lambda import LayerVersion
+from constructs.lambda_layer_construct import LambdaLayerConstruct, COMMON_LAYER_PATH
+import unittest
+
+class TestLambdaLayerConstruct(unittest.TestCase):
+    """Lambda Layer Construct testing class."""
+    
+    def setUp(self):
+        self.stack = Mock()
+        self.env = "test"
+        self.config = {'test': {'appName': 'test-app-name'}}
+        
+    @patch('aws_cdk.aws_lambda.Code.from_asset')
+    @patch('aws_cdk.aws_lambda.LayerVersion')
+    def test_create_common_layer(self, MockLayerVersion, mock_from_asset):
+        # Arrange
+        layer_instance = Mock(spec=LayerVersion)
+        MockLayerVersion.return_value = layer_instance
+
+        # Act
+        result = LambdaLayerConstruct.create_common_layer(self.stack, self.env, self.config)
+        
+        # Assert
+        mock_from_asset.assert_called_once_with(COMMON_LAYER_PATH, exclude=["test_*", "**/__pycache__"])
+        kwargs = MockLayerVersion.call_args[1]
+        self.assertEqual(kwargs['scope'], self.stack)
+        self.assertEqual(kwargs['id'], "test-app-name-common-layer-Id")
+        self.assertEqual(kwargs['code'], mock_from_asset.return_value)
+        self.assertEqual(result, layer_instance)
+
+    def test_attach_common_layer(self):
+        functions = [Mock(), Mock()]
+        layer = Mock()
+
+        LambdaLayerConstruct.attach_common_layer(functions, layer)
+
+        for function in functions:
+            function.add_layers.assert_called_once_with(layer)
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,14 @@
 """Run as a Map state to generate csv files for all TAA segments."""
-import os, io, json, logging, time, boto3, pandas as pd
+from __future__ import annotations
+import os, io, json, logging, time, boto3
+from typing import TYPE_CHECKING
+from structured_logging import log
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger()
 
 def lambda_handler(
     event: dict,
@@ -9,7 +16,7 @@ def lambda_handler(
 ) -> dict:
     """Lambda handler."""
     if event:
-        logging.info(f"Event: {event}")
+        log(logger, logging.INFO, "Event", event=event)
         event = event["Input"]
         file_date = event["file_date"]
         gl_code = event["GL_CODE"]
@@ -45,6 +52,7 @@ def create_output_template_df(
     file_key: str
 ) -> pd.DataFrame:
     """Method to create a Dataframe from a template file in S3 location."""
+    import pandas as pd
     try:
         s3 = boto3.client("s3")
         file_obj = s3.get_object(Bucket=bucket_name, Key=file_key)
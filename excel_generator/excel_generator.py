@@ -1,7 +1,36 @@
 """Generates single excel file by appending multiple CSV files as different sheets."""
-import io, os, logging, boto3, pandas as pd
+from __future__ import annotations
+import io, os, re, csv, json, math, shutil, logging, zipfile, tempfile, threading, boto3
+from collections import deque
+from contextlib import closing
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Tuple
+from s3_purge import purge_prefix
+from structured_logging import log
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger()
+
+# Fields pandas.read_csv treats as missing; they are left as blank cells.
+NA_VALUES = frozenset({
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None", "n/a", "nan", "null"
+})
+# Fields pandas.read_csv parses as numbers; no digit separators or surrounding whitespace.
+NUMBER_PATTERN = re.compile(r"[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?")
+# Integers with leading zeros are identifiers, their column is kept as text.
+# pandas.read_csv would parse them as numbers and drop the zeros.
+LEADING_ZERO_PATTERN = re.compile(r"[+-]?0\d+")
+READ_AHEAD_SHEETS = 4
+READ_AHEAD_MAX_BYTES = 64 * 1024 * 1024
+TEMPLATE_KEY = "processing/PurchTempalte.csv"
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+OUTPUT_FILE_NAME = "Purchassetspreads.xslx"
+MANIFEST_FILE_NAME = "Purchassetspreads.manifest.json"
 
 
 def lambda_handler(
@@ -10,14 +39,22 @@ def lambda_handler(
 ) -> dict:
     if event:
         try:
-            logging.info(f"Event: {event}")
-            file_date = event[0]["Payload"]["file_date"]
-            edit_file_name = f"20{file_date[4:]}-{file_date[0:2]}-{file_date[2:4]}"
-            generate_excel(
-                filenames = os.environ['bucket_name'],
-                bucket_name = os.environ['bucket_name'],
-                file_key = os.environ['csv_file_key']
-            )
+            log(logger, logging.INFO, "Event", event=event)
+            if os.environ.get('sheet_source', 'csv') == 'segments':
+                # Single pass: the event is the parser output and sheets are
+                # filled from segment values, the csv Map stage is not run.
+                generate_excel_from_segments(
+                    records = event["Output"]["Records"],
+                    bucket_name = os.environ['bucket_name'],
+                    file_key = os.environ['csv_file_key'],
+                    template_key = os.environ.get('template_key', TEMPLATE_KEY)
+                )
+            else:
+                generate_excel(
+                    filenames = event,
+                    bucket_name = os.environ['bucket_name'],
+                    file_key = os.environ['csv_file_key']
+                )
             logging.info("Deleting files from S3.")
             delete_files(
                 bucket_name = os.environ['bucket_name'],
@@ -40,6 +77,7 @@ def create_df_from_csv_in_s3(
     file_key: str
 ) -> pd.DataFrame:
     """Method to create a Pandas Dataframe from a csv in s3 location."""
+    import pandas as pd
     try:
         s3 = boto3.client('s3')
         obj = s3.get_object(Bucket=bucket_name, Key=file_key)
@@ -48,47 +86,591 @@ def create_df_from_csv_in_s3(
         logging.error(f"Error: {error}")
         raise error
 
+def iter_csv_rows(body) -> Iterator[list]:
+    """Method to iterate the rows of a binary csv stream."""
+    return csv.reader(io.TextIOWrapper(body, encoding='utf-8-sig', newline=''))
+
+class ReadAheadBudget:
+    """Byte budget for prefetched sheet sources.
+
+    Bytes are granted strictly in submission order and a source is always
+    admitted when nothing else is held, so the sheet being written can never
+    be starved by sources queued behind it.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._used = 0
+        self._next_ticket = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def acquire(self, ticket: int, size: int) -> None:
+        with self._condition:
+            self._condition.wait_for(lambda: self._closed or (
+                ticket == self._next_ticket
+                and (self._used == 0 or self._used + size <= self._max_bytes)
+            ))
+            if self._closed:
+                raise RuntimeError("Read-ahead cancelled.")
+            self._used += size
+            self._next_ticket += 1
+            self._condition.notify_all()
+
+    def release(self, size: int) -> None:
+        with self._condition:
+            self._used -= size
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+def _fetch_sheet_source(
+    s3,
+    bucket_name: str,
+    file_key: str,
+    ticket: int,
+    budget: ReadAheadBudget
+) -> bytes:
+    """Method to download one sheet source once the read-ahead budget admits it."""
+    try:
+        obj = s3.get_object(Bucket=bucket_name, Key=file_key)
+    except Exception:
+        budget.acquire(ticket, 0)
+        raise
+    budget.acquire(ticket, obj['ContentLength'])
+    return obj['Body'].read()
+
+def prefetch_sheet_sources(
+    bucket_name: str,
+    sources: List[Tuple[str, str]],
+    read_ahead: int = READ_AHEAD_SHEETS,
+    max_bytes: int = READ_AHEAD_MAX_BYTES
+) -> Iterator[Tuple[str, bytes]]:
+    """Method to yield (sheet_name, content) in order while the next sources download in the background."""
+    s3 = boto3.client('s3')
+    budget = ReadAheadBudget(max_bytes)
+    pending = iter(enumerate(sources))
+    in_flight = deque()
+    executor = ThreadPoolExecutor(max_workers=read_ahead)
+
+    def submit_next() -> None:
+        for ticket, (sheet_name, file_key) in pending:
+            in_flight.append((sheet_name, executor.submit(
+                _fetch_sheet_source, s3, bucket_name, file_key, ticket, budget
+            )))
+            return
+
+    try:
+        for _ in range(read_ahead):
+            submit_next()
+        while in_flight:
+            sheet_name, future = in_flight.popleft()
+            content = future.result()
+            submit_next()
+            try:
+                yield sheet_name, content
+            finally:
+                budget.release(len(content))
+    except Exception as error:
+        logging.error(f"Error: {error}")
+        raise error
+    finally:
+        budget.close()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def _field_kind(value):
+    """Method to classify a field as None (missing), "bool", "number" or "string".
+
+    Rendered rows mix csv text with values already typed by json, such as
+    the segment values fill_segment_rows writes into the template.
+    """
+    if not isinstance(value, str):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            return None
+        if isinstance(value, bool):
+            return "bool"
+        if isinstance(value, (int, float)):
+            return "number"
+        return "string"
+    if value in NA_VALUES:
+        return None
+    if value in ("True", "False"):
+        return "bool"
+    if NUMBER_PATTERN.fullmatch(value) and not LEADING_ZERO_PATTERN.fullmatch(value):
+        return "number"
+    return "string"
+
+def column_kinds(rows: Iterable[list]) -> List[str]:
+    """Method to type each column from all of its data fields.
+
+    A column is "number" or "bool" only when every non-missing field is, as
+    in pandas a single text field keeps the whole column as text. Unlike
+    pandas.read_csv, a zero-padded integer such as "0012" counts as text,
+    so zero-padded code columns are written as text cells with their zeros.
+    """
+    kinds = []
+    for row_index, row in enumerate(rows):
+        if not row_index:
+            continue
+        for col_index, field in enumerate(row):
+            kind = _field_kind(field)
+            if col_index >= len(kinds):
+                kinds.extend([None] * (col_index + 1 - len(kinds)))
+            if kind is not None and kinds[col_index] != kind:
+                kinds[col_index] = kind if kinds[col_index] is None else "string"
+    return [kind or "string" for kind in kinds]
+
+def _typed_cell(value, kind: str = "string"):
+    """Method to convert a csv field to the value pandas would have written to excel."""
+    if not isinstance(value, str):
+        return value
+    if value in NA_VALUES:
+        return None
+    if kind == "bool":
+        return value == "True"
+    if kind == "number":
+        return float(value)
+    return value
+
+def write_rows_to_sheet(
+    workbook,
+    sheet_name: str,
+    rows: Iterable[list],
+    kinds: List[str] = None
+) -> int:
+    """Method to write csv rows to a new sheet, header first, typing cells by their column's kind.
+
+    Without kinds the rows are held in memory to compute them; streaming
+    callers pass column_kinds() of a second pass over the same source.
+    """
+    if kinds is None:
+        rows = list(rows)
+        kinds = column_kinds(rows)
+    worksheet = workbook.add_worksheet(sheet_name)
+    row_count = 0
+    for row_index, row in enumerate(rows):
+        for col_index, field in enumerate(row):
+            kind = kinds[col_index] if col_index < len(kinds) else "string"
+            value = _typed_cell(field, kind) if row_index else field
+            if value is None or value == "" or (isinstance(value, float) and math.isnan(value)):
+                continue
+            if isinstance(value, bool):
+                worksheet.write_boolean(row_index, col_index, value)
+            elif isinstance(value, (int, float)):
+                worksheet.write_number(row_index, col_index, value)
+            else:
+                worksheet.write_string(row_index, col_index, value)
+        row_count += 1
+    return row_count
+
+def fill_segment_rows(
+    template_rows: List[list],
+    values: List[list]
+) -> List[list]:
+    """Method to fill the template's data rows with a segment's h1, h2 and h3 values.
+
+    Row i + 3 gets values_h1[i] in its first 12 empty cells, values_h2[i] in
+    the next 12 and values_h3[i] in the rest, as csv_generator does.
+    """
+    rows = list(template_rows)
+    for horizon_values, limit in zip(values, (12, 12, None)):
+        for i, value in enumerate(horizon_values):
+            row = rows[i + 3] = list(rows[i + 3])
+            remaining = limit
+            for col_index, field in enumerate(row):
+                if remaining == 0:
+                    break
+                if isinstance(field, str) and field in NA_VALUES:
+                    row[col_index] = value
+                    if remaining is not None:
+                        remaining -= 1
+    return rows
+
+class S3MultipartWriter(io.RawIOBase):
+    """Write-only stream that uploads to S3 in multipart parts as data arrives.
+
+    Each part is collected in a spooled buffer and uploaded once it reaches
+    part_size. An object that never fills a part is sent with a single
+    put_object instead of a multipart upload.
+    """
+
+    def __init__(self, s3, bucket_name: str, key: str, part_size: int = MULTIPART_PART_SIZE):
+        super().__init__()
+        self._s3 = s3
+        self._bucket_name = bucket_name
+        self._key = key
+        self._part_size = part_size
+        self._buffer = tempfile.SpooledTemporaryFile(max_size=part_size)
+        self._position = 0
+        self._upload_id = None
+        self._parts = []
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def write(self, data) -> int:
+        self._buffer.write(data)
+        self._position += len(data)
+        if self._buffer.tell() >= self._part_size:
+            self._upload_part()
+        return len(data)
+
+    def _upload_part(self) -> None:
+        if self._upload_id is None:
+            self._upload_id = self._s3.create_multipart_upload(
+                Bucket=self._bucket_name, Key=self._key
+            )['UploadId']
+        self._buffer.seek(0)
+        part_number = len(self._parts) + 1
+        response = self._s3.upload_part(
+            Bucket=self._bucket_name,
+            Key=self._key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=self._buffer.read()
+        )
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self._buffer.seek(0)
+        self._buffer.truncate()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                self._buffer.seek(0)
+                self._s3.put_object(Bucket=self._bucket_name, Key=self._key, Body=self._buffer.read())
+            else:
+                if self._buffer.tell():
+                    self._upload_part()
+                self._s3.complete_multipart_upload(
+                    Bucket=self._bucket_name,
+                    Key=self._key,
+                    UploadId=self._upload_id,
+                    MultipartUpload={'Parts': self._parts}
+                )
+            logging.info(f"Uploaded {self._position} bytes to {self._key} in {max(len(self._parts), 1)} part(s).")
+        finally:
+            self._buffer.close()
+            super().close()
+
+    def abort(self) -> None:
+        """Method to discard everything written so far, including uploaded parts."""
+        if self._upload_id is not None:
+            self._s3.abort_multipart_upload(
+                Bucket=self._bucket_name, Key=self._key, UploadId=self._upload_id
+            )
+        self._buffer.close()
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+def fetch_source_etags(
+    s3,
+    bucket_name: str,
+    keys: List[str]
+) -> Dict[str, str]:
+    """Method to look up the ETag of every sheet source concurrently."""
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        etags = executor.map(lambda key: s3.head_object(Bucket=bucket_name, Key=key)['ETag'], keys)
+        return dict(zip(keys, etags))
+
+def load_manifest(
+    s3,
+    bucket_name: str,
+    manifest_key: str
+) -> dict:
+    """Method to read the manifest of the previous build, empty when there is none.
+
+    Without s3:ListBucket a missing key is reported as AccessDenied rather
+    than NoSuchKey, so any failure to read it falls back to a full rebuild.
+    """
+    try:
+        obj = s3.get_object(Bucket=bucket_name, Key=manifest_key)
+        return json.loads(obj['Body'].read())
+    except Exception as error:
+        logging.warning(f"Previous manifest unavailable, rebuilding every sheet: {error}")
+        return {}
+
+def splice_sheet_parts(
+    new_workbook,
+    replacements: Dict[str, Callable[[], IO[bytes]]],
+    output
+) -> None:
+    """Method to copy new_workbook into output, swapping in the parts listed in replacements.
+
+    replacements maps a part name to a callable opening the content to use
+    instead. Sheets are written with inline strings and default styles, so a
+    worksheet part is self-contained and can be moved between workbooks.
+    """
+    with zipfile.ZipFile(new_workbook) as source, \
+            zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            part = info.filename
+            reader = replacements[part]() if part in replacements else source.open(part)
+            target_info = zipfile.ZipInfo(part, info.date_time)
+            target_info.compress_type = zipfile.ZIP_DEFLATED
+            with reader, target.open(target_info, 'w') as writer:
+                shutil.copyfileobj(reader, writer, 1024 * 1024)
+
+def render_sheet_part(
+    rows: Iterable[list],
+    part_path: str,
+    selected: bool,
+    kinds: List[str] = None
+) -> None:
+    """Method to render rows as a standalone worksheet XML part at part_path."""
+    import xlsxwriter
+    tmpdir = os.path.dirname(part_path)
+    workbook_path = f"{part_path}.xlsx"
+    workbook = xlsxwriter.Workbook(workbook_path, {"constant_memory": True, "tmpdir": tmpdir})
+    write_rows_to_sheet(workbook, "Sheet1", rows, kinds)
+    workbook.close()
+    with zipfile.ZipFile(workbook_path) as package, \
+            package.open("xl/worksheets/sheet1.xml") as part, open(part_path, "wb") as output:
+        head = part.read(4096)
+        if not selected:
+            # Only the workbook's first sheet is the selected tab.
+            head = head.replace(b' tabSelected="1"', b'', 1)
+        output.write(head)
+        shutil.copyfileobj(part, output, 1024 * 1024)
+    os.remove(workbook_path)
+
+def _sheet_worker(
+    conn,
+    render: Callable[[str, bytes], Iterable[list]],
+    bucket_name: str,
+    tmpdir: str
+) -> None:
+    """Worker process loop: download, render and serialize one sheet per task."""
+    s3 = boto3.client('s3')
+    for index, sheet_name, key in iter(conn.recv, None):
+        try:
+            content = s3.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+            part_path = os.path.join(tmpdir, f"sheet{index + 1}.xml")
+            render_sheet_part(
+                render(sheet_name, content), part_path, selected=index == 0,
+                kinds=column_kinds(render(sheet_name, content))
+            )
+            conn.send((index, part_path, None))
+        except Exception as error:
+            conn.send((index, None, f"{sheet_name}: {error}"))
+    conn.close()
+
+def render_sheet_parts(
+    sources: List[Tuple[int, str, str]],
+    render: Callable[[str, bytes], Iterable[list]],
+    bucket_name: str,
+    tmpdir: str,
+    workers: int
+) -> Dict[int, str]:
+    """Method to render (index, sheet_name, key) sources to worksheet parts in worker processes.
+
+    Uses Process and Pipe rather than a Pool, which needs /dev/shm and is not
+    available on Lambda. Returns the part file path for each sheet index.
+    """
+    import multiprocessing
+    from multiprocessing.connection import wait
+    context = multiprocessing.get_context("fork")
+    pending = iter(sources)
+    processes, connections = [], []
+    parts = {}
+    try:
+        for _ in range(min(workers, len(sources))):
+            parent_conn, child_conn = context.Pipe()
+            connections.append(parent_conn)
+            process = context.Process(target=_sheet_worker, args=(child_conn, render, bucket_name, tmpdir))
+            process.start()
+            child_conn.close()
+            processes.append(process)
+            parent_conn.send(next(pending))
+        busy = list(connections)
+        while busy:
+            for conn in wait(busy):
+                index, part_path, error = conn.recv()
+                if error:
+                    raise RuntimeError(f"Rendering sheet failed: {error}")
+                parts[index] = part_path
+                task = next(pending, None)
+                conn.send(task)
+                if task is None:
+                    busy.remove(conn)
+    finally:
+        for conn in connections:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            finally:
+                conn.close()
+        for process in processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+            # Releases the process sentinel's file descriptor
+            process.close()
+    return parts
+
+def sheet_workers() -> int:
+    """Method to size the render pool: the Lambda's vCPUs when parallel_sheets is on, else 1."""
+    if os.environ.get('parallel_sheets', 'false').lower() != 'true':
+        return 1
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def write_workbook(
+    sources: List[Tuple[str, str]],
+    render: Callable[[str, bytes], Iterable[list]],
+    bucket_name: str,
+    edited_file_key: str,
+    shared_fingerprint: str = ""
+) -> None:
+    """Method to build the workbook from (sheet_name, source_key) pairs and stream it to S3.
+
+    A manifest next to the workbook records each sheet's source ETag. On a
+    rerun only sheets whose source changed are rendered; the others are
+    copied from the previous workbook. shared_fingerprint covers inputs used
+    by every sheet, such as the template, and forces a full build when it
+    changes. With parallel_sheets on, changed sheets are serialized in worker
+    processes and the main process only assembles the package.
+    """
+    import xlsxwriter
+    s3 = boto3.client('s3')
+    output_key = f"processed/{edited_file_key}/{OUTPUT_FILE_NAME}"
+    manifest_key = f"processed/{edited_file_key}/{MANIFEST_FILE_NAME}"
+    etags = fetch_source_etags(s3, bucket_name, [key for _, key in sources])
+    previous = load_manifest(s3, bucket_name, manifest_key)
+    reused = {}
+    if previous.get("shared_fingerprint") == shared_fingerprint:
+        reused = {
+            sheet_name: previous["sheets"][sheet_name]["part"]
+            for sheet_name, key in sources
+            if previous["sheets"].get(sheet_name, {}).get("etag") == etags[key]
+        }
+    previous_workbook = tempfile.TemporaryFile()
+    if reused:
+        try:
+            s3.download_fileobj(bucket_name, output_key, previous_workbook)
+        except Exception as error:
+            logging.warning(f"Previous workbook unavailable, rebuilding every sheet: {error}")
+            reused = {}
+    changed = [
+        (index, sheet_name, key)
+        for index, (sheet_name, key) in enumerate(sources)
+        if sheet_name not in reused
+    ]
+    workers = sheet_workers()
+    logging.info(f"Rendering {len(changed)} of {len(sources)} sheets with {workers} worker(s), reusing {len(reused)}.")
+
+    with tempfile.TemporaryDirectory() as tmpdir, previous_workbook:
+        replacements = {}
+        if reused:
+            previous_package = zipfile.ZipFile(previous_workbook)
+            for index, (sheet_name, _) in enumerate(sources):
+                if sheet_name in reused:
+                    replacements[f"xl/worksheets/sheet{index + 1}.xml"] = partial(previous_package.open, reused[sheet_name])
+        if workers > 1 and len(changed) > 1:
+            for index, part_path in render_sheet_parts(changed, render, bucket_name, tmpdir, workers).items():
+                replacements[f"xl/worksheets/sheet{index + 1}.xml"] = partial(open, part_path, 'rb')
+            changed = []
+        rendered = prefetch_sheet_sources(
+            bucket_name = bucket_name,
+            sources = [(sheet_name, key) for _, sheet_name, key in changed],
+            read_ahead = int(os.environ.get('read_ahead_sheets', READ_AHEAD_SHEETS)),
+            max_bytes = int(os.environ.get('read_ahead_max_bytes', READ_AHEAD_MAX_BYTES))
+        )
+        with closing(rendered), S3MultipartWriter(s3, bucket_name, output_key) as output:
+            # constant_memory flushes each row to disk as soon as the next one starts,
+            # so memory stays flat however many sheets the workbook has. The zip
+            # package is compressed straight into the upload, never onto /tmp,
+            # unless parts have to be spliced in.
+            new_workbook = tempfile.TemporaryFile(dir=tmpdir) if replacements else output
+            workbook = xlsxwriter.Workbook(new_workbook, {"constant_memory": True, "tmpdir": tmpdir})
+            manifest = {"shared_fingerprint": shared_fingerprint, "sheets": {}}
+            for index, (sheet_name, key) in enumerate(sources):
+                part = f"xl/worksheets/sheet{index + 1}.xml"
+                manifest["sheets"][sheet_name] = {"etag": etags[key], "part": part}
+                if part in replacements:
+                    workbook.add_worksheet(sheet_name)
+                    continue
+                _, content = next(rendered)
+                logging.info(f"Adding {sheet_name} to sheet excel.")
+                write_rows_to_sheet(
+                    workbook, sheet_name, render(sheet_name, content), column_kinds(render(sheet_name, content))
+                )
+            workbook.close()
+            if replacements:
+                with new_workbook:
+                    splice_sheet_parts(new_workbook, replacements, output)
+    s3.put_object(Bucket=bucket_name, Key=manifest_key, Body=json.dumps(manifest).encode("UTF-8"))
+
 def generate_excel(
     filenames: list,
     bucket_name: str,
     file_key: str
 ) -> None:
     """Method to generate a consolidated excel file for all segments."""
-    s3 = boto3.client('s3')
     file_date = filenames[0]["Payload"]["file_date"]
     edited_file_key = f"yyyy=20{file_date[4:]}-mm={file_date[0:2]}-dd={file_date[2:4]}"
-    writer = pd.ExcelWriter(f"/tmp/Purchassetspreads.xslx", engine='xlsxwriter')
-    logging.info("Addingtable properties to sheet excel.")
-    table_ppt_df = create_df_from_csv_in_s3(
-        bucket_name = bucket_name,
-        file_key = f"{file_key}/{edited_file_key}/TableProperties.csv"
-    )
-    table_ppt_df.to_excel(writer, sheet_name='TableProperties', index=False)
+    sources = [('TableProperties', f"{file_key}/{edited_file_key}/TableProperties.csv")]
     for filename in filenames:
-        logging.info(f"Adding {filename} to sheet excel.")
         file = filename["Payload"]["file_name"]
-        data_frame = create_df_from_csv_in_s3(
-            bucket_name = bucket_name,
-            file_key = f"{file_key}/{edited_file_key}/{file}"
-        )
-        data_frame.to_excel(writer, sheet_name=file, index=False)
-    writer.close()
-    s3.upload_file(
-        Filename = f"/tmp/Purchassetspreads.xslx",
-        Bucket = bucket_name,
-        Key = f"processed/{edited_file_key}/Purchassetspreads.xslx"
+        sources.append((file, f"{file_key}/{edited_file_key}/{file}"))
+    write_workbook(
+        sources = sources,
+        render = lambda sheet_name, content: iter_csv_rows(io.BytesIO(content)),
+        bucket_name = bucket_name,
+        edited_file_key = edited_file_key
+    )
+
+def generate_excel_from_segments(
+    records: list,
+    bucket_name: str,
+    file_key: str,
+    template_key: str = TEMPLATE_KEY
+) -> None:
+    """Method to generate the consolidated excel file straight from the parser's segment values."""
+    s3 = boto3.client('s3')
+    file_date = records[0]["File_date"]
+    edited_file_key = f"yyyy=20{file_date[4:]}-mm={file_date[0:2]}-dd={file_date[2:4]}"
+    template_obj = s3.get_object(Bucket=bucket_name, Key=template_key)
+    header, *template_rows = iter_csv_rows(template_obj['Body'])
+    sources = [('TableProperties', f"{file_key}/{edited_file_key}/TableProperties.csv")]
+    for record in records:
+        sources.append((f"InvestPctSeg{record['GL_Code']}", record["data_path"]))
+
+    def render(sheet_name: str, content: bytes) -> Iterable[list]:
+        if sheet_name == 'TableProperties':
+            return iter_csv_rows(io.BytesIO(content))
+        segment = json.loads(content)
+        values = [segment["values_h1"], segment["values_h2"], segment["values_h3"]]
+        return [header] + fill_segment_rows(template_rows, values)
+
+    write_workbook(
+        sources = sources,
+        render = render,
+        bucket_name = bucket_name,
+        edited_file_key = edited_file_key,
+        shared_fingerprint = template_obj['ETag']
     )
     
 def delete_files(bucket_name: str, file_key: str) -> None:
     """Method to delete files from S3."""
     try:
-        s3_client = boto3.client('s3')
-        s3_resource = boto3.resource('s3')
-        bucket = s3_resource.Bucket(bucket_name)
-        for obj in bucket.objects.filter(Prefix=file_key):
-            path, file = os.path.split(obj.key)
-            s3_client.delete_object(Bucket=bucket_name, Key=obj.key)
+        purge_prefix(bucket_name, file_key)
     except Exception as error:
         logging.error(f"Error: {error}")
-        raise error        
-    
\ No newline at end of file
+        raise error
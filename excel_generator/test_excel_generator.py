@@ -1,8 +1,15 @@
+import os
+import sys
 import unittest
 import io
+import json
+import zipfile
+import tempfile
 import pandas as pd
-from unittest.mock import patch, Mock
-from excel_generator import lambda_handler, generate_excel, delete_files, create_df_from_csv_in_s3
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common", "python"))
+from unittest.mock import patch, Mock, call
+from botocore.exceptions import ClientError
+from excel_generator import lambda_handler, generate_excel, delete_files, create_df_from_csv_in_s3, iter_csv_rows, write_rows_to_sheet, prefetch_sheet_sources, ReadAheadBudget, fill_segment_rows, generate_excel_from_segments, S3MultipartWriter, write_workbook, render_sheet_parts, load_manifest
 
 class TestExcelGenerator(unittest.TestCase):
 
@@ -16,15 +23,25 @@ class TestExcelGenerator(unittest.TestCase):
         mock_generate_excel.assert_called_once()
         mock_delete_files.assert_called_once()
 
+    @patch('excel_generator.generate_excel_from_segments')
+    @patch('excel_generator.delete_files')
+    @patch.dict('os.environ', {'bucket_name': 'test-bucket', 'csv_file_key': 'test-key', 'sheet_source': 'segments'})
+    def test_lambda_handler_segments_event(self, mock_delete_files, mock_generate_from_segments):
+        records = [{"File_date": "010120", "GL_Code": 1, "data_path": "processing/gl_codes/1/data.json"}]
+        response = lambda_handler({"Status": "Success", "Output": {"Records": records}}, {})
+        self.assertEqual(response["status"], "success")
+        mock_generate_from_segments.assert_called_once_with(
+            records=records, bucket_name='test-bucket', file_key='test-key', template_key='processing/PurchTempalte.csv'
+        )
+
     def test_lambda_handler_no_event(self):
         with self.assertRaises(OSError):
             lambda_handler(None, {})
 
-    @patch('excel_generator.boto3.client')
-    @patch('excel_generator.boto3.resource')
-    def test_delete_files(self, mock_boto_resource, mock_boto_client):
+    @patch('excel_generator.purge_prefix')
+    def test_delete_files(self, mock_purge_prefix):
         delete_files('test-bucket', 'test-key')
-        # Add assertions based on the expected behavior
+        mock_purge_prefix.assert_called_once_with('test-bucket', 'test-key')
 
     @patch('excel_generator.boto3.client')
     def test_create_df_from_csv_in_s3_valid(self, mock_boto_client):
@@ -38,5 +55,218 @@ class TestExcelGenerator(unittest.TestCase):
         self.assertEqual(result.iloc[0]['test'], 1)
         self.assertEqual(result.iloc[0]['data'], 2)
 
+    def test_iter_csv_rows(self):
+        rows = list(iter_csv_rows(io.BytesIO(b'name,value\n"a,b",2\n')))
+        self.assertEqual(rows, [['name', 'value'], ['a,b', '2']])
+
+    def test_write_rows_to_sheet_types_cells(self):
+        workbook = Mock()
+        worksheet = workbook.add_worksheet.return_value
+
+        row_count = write_rows_to_sheet(workbook, 'Seg1', [['name', 'value', 'flag'], ['x', '1.5', 'True'], ['10', '', 'nan']])
+
+        self.assertEqual(row_count, 3)
+        workbook.add_worksheet.assert_called_once_with('Seg1')
+        worksheet.write_string.assert_any_call(0, 1, 'value')
+        worksheet.write_string.assert_any_call(1, 0, 'x')
+        worksheet.write_number.assert_called_once_with(1, 1, 1.5)
+        # A text field keeps its whole column as text, as pandas would
+        worksheet.write_string.assert_any_call(2, 0, '10')
+        worksheet.write_boolean.assert_called_once_with(1, 2, True)
+        self.assertEqual(worksheet.write_string.call_count, 5)
+
+    def test_write_rows_to_sheet_keeps_id_columns_as_text(self):
+        workbook = Mock()
+        worksheet = workbook.add_worksheet.return_value
+        rows = [['id', 'code', 'amount', 'raw'], ['0012', '7', '-1.5e3', '1_000'], ['0345', '08', '', ' 5 '], ['A7', '15', '2', '3']]
+
+        write_rows_to_sheet(workbook, 'Seg1', rows)
+
+        for row_index, field in enumerate(['0012', '0345', 'A7'], start=1):
+            worksheet.write_string.assert_any_call(row_index, 0, field)
+        for row_index, field in enumerate(['7', '08', '15'], start=1):
+            worksheet.write_string.assert_any_call(row_index, 1, field)
+        for row_index, field in enumerate(['1_000', ' 5 ', '3'], start=1):
+            worksheet.write_string.assert_any_call(row_index, 3, field)
+        self.assertEqual(worksheet.write_number.call_args_list, [call(1, 2, -1500.0), call(3, 2, 2.0)])
+
+    @patch('excel_generator.boto3.client')
+    def test_prefetch_sheet_sources_keeps_order(self, mock_boto_client):
+        contents = {f'key/{i}': f'sheet{i}'.encode() for i in range(6)}
+        mock_s3 = Mock()
+        mock_s3.get_object.side_effect = lambda Bucket, Key: {
+            'Body': io.BytesIO(contents[Key]), 'ContentLength': len(contents[Key])
+        }
+        mock_boto_client.return_value = mock_s3
+
+        sources = [(f'S{i}', f'key/{i}') for i in range(6)]
+        result = list(prefetch_sheet_sources('test-bucket', sources, read_ahead=3, max_bytes=8))
+        self.assertEqual(result, [(f'S{i}', f'sheet{i}'.encode()) for i in range(6)])
+
+    @patch('excel_generator.boto3.client')
+    def test_prefetch_sheet_sources_raises_fetch_error(self, mock_boto_client):
+        mock_s3 = Mock()
+        mock_s3.get_object.side_effect = Exception("S3 object not found")
+        mock_boto_client.return_value = mock_s3
+
+        with self.assertRaises(Exception):
+            list(prefetch_sheet_sources('test-bucket', [('S0', 'key/0'), ('S1', 'key/1')]))
+
+    def test_read_ahead_budget_admits_oversized_source_when_empty(self):
+        budget = ReadAheadBudget(max_bytes=10)
+        budget.acquire(0, 50)
+        budget.release(50)
+        budget.acquire(1, 6)
+        budget.close()
+        with self.assertRaises(RuntimeError):
+            budget.acquire(2, 6)
+
+    def test_fill_segment_rows_matches_horizon_limits(self):
+        template_rows = [['h'] + [''] * 26 for _ in range(4)]
+        filled = fill_segment_rows(template_rows, [[1.0], [2.0], [3.0]])
+
+        self.assertEqual(filled[:3], template_rows[:3])
+        self.assertEqual(filled[3], ['h'] + [1.0] * 12 + [2.0] * 12 + [3.0] * 2)
+        self.assertEqual(template_rows[3], ['h'] + [''] * 26)
+
+    @patch('excel_generator.boto3.client')
+    def test_generate_excel_from_segments(self, mock_boto_client):
+        mock_s3, stored = self._s3_with_objects({
+            'template.csv': b'name,a,b\nr0,x,y\nr1,,\nr2,,\nr3,,\nr4,,\n',
+            'test-key/yyyy=2020-mm=01-dd=01/TableProperties.csv': b'Name\nInvestPctSeg7\n',
+            'processing/gl_codes/7/data.json': b'{"values_h1": [5, NaN], "values_h2": [6, 6], "values_h3": [7, 7]}',
+        })
+        mock_boto_client.return_value = mock_s3
+
+        records = [{"File_date": "010120", "GL_Code": 7, "data_path": "processing/gl_codes/7/data.json"}]
+        generate_excel_from_segments(records, 'test-bucket', 'test-key', template_key='template.csv')
+
+        output = io.BytesIO(stored['processed/yyyy=2020-mm=01-dd=01/Purchassetspreads.xslx'])
+        workbook = pd.read_excel(output, sheet_name=None)
+        self.assertEqual(list(workbook), ['TableProperties', 'InvestPctSeg7'])
+        self.assertEqual(workbook['TableProperties']['Name'].tolist(), ['InvestPctSeg7'])
+        segment = workbook['InvestPctSeg7']
+        self.assertEqual(list(segment.columns), ['name', 'a', 'b'])
+        self.assertEqual(segment.iloc[3].tolist(), ['r3', 5, 5])
+        # A NaN left by the parser's merges is a blank cell
+        self.assertTrue(segment.iloc[4][['a', 'b']].isna().all())
+        manifest = json.loads(stored['processed/yyyy=2020-mm=01-dd=01/Purchassetspreads.manifest.json'])
+        self.assertEqual(manifest['shared_fingerprint'], mock_s3.get_object(Bucket='test-bucket', Key='template.csv')['ETag'])
+
+    def _s3_with_objects(self, objects):
+        mock_s3 = Mock()
+        stored = dict(objects)
+
+        def get_object(Bucket, Key):
+            if Key not in stored:
+                raise ClientError({'Error': {'Code': 'NoSuchKey'}}, 'GetObject')
+            return {'Body': io.BytesIO(stored[Key]), 'ContentLength': len(stored[Key]), 'ETag': f'"{hash(stored[Key])}"'}
+
+        mock_s3.get_object.side_effect = get_object
+        mock_s3.head_object.side_effect = lambda Bucket, Key: {'ETag': f'"{hash(stored[Key])}"'}
+        mock_s3.put_object.side_effect = lambda Bucket, Key, Body: stored.__setitem__(Key, Body)
+        mock_s3.download_fileobj.side_effect = lambda Bucket, Key, fileobj: fileobj.write(stored[Key])
+        return mock_s3, stored
+
+    @patch('excel_generator.boto3.client')
+    def test_write_workbook_reuses_unchanged_sheets(self, mock_boto_client):
+        mock_s3, stored = self._s3_with_objects({'src/a.csv': b'x\n1\n', 'src/b.csv': b'y\n2\n'})
+        mock_boto_client.return_value = mock_s3
+        sources = [('A', 'src/a.csv'), ('B', 'src/b.csv')]
+        render = Mock(side_effect=lambda sheet_name, content: iter_csv_rows(io.BytesIO(content)))
+
+        write_workbook(sources, render, 'test-bucket', 'yyyy=2020-mm=01-dd=01')
+        self.assertEqual({call_args[0][0] for call_args in render.call_args_list}, {'A', 'B'})
+
+        stored['src/b.csv'] = b'y\n3\n'
+        render.reset_mock()
+        write_workbook(sources, render, 'test-bucket', 'yyyy=2020-mm=01-dd=01')
+
+        self.assertEqual({call_args[0][0] for call_args in render.call_args_list}, {'B'})
+        workbook = pd.read_excel(io.BytesIO(stored['processed/yyyy=2020-mm=01-dd=01/Purchassetspreads.xslx']), sheet_name=None)
+        self.assertEqual(workbook['A']['x'].tolist(), [1])
+        self.assertEqual(workbook['B']['y'].tolist(), [3])
+
+    @patch.dict('os.environ', {'parallel_sheets': 'true'})
+    @patch('excel_generator.os.sched_getaffinity', return_value={0, 1})
+    @patch('excel_generator.boto3.client')
+    def test_write_workbook_renders_sheets_in_processes(self, mock_boto_client, mock_affinity):
+        objects = {f'src/{i}.csv': f'col\n{i}\n'.encode() for i in range(4)}
+        mock_s3, stored = self._s3_with_objects(objects)
+        mock_boto_client.return_value = mock_s3
+        sources = [(f'S{i}', f'src/{i}.csv') for i in range(4)]
+
+        write_workbook(sources, lambda sheet_name, content: iter_csv_rows(io.BytesIO(content)), 'test-bucket', 'yyyy=2020-mm=01-dd=01')
+
+        output = io.BytesIO(stored['processed/yyyy=2020-mm=01-dd=01/Purchassetspreads.xslx'])
+        workbook = pd.read_excel(output, sheet_name=None)
+        self.assertEqual(list(workbook), ['S0', 'S1', 'S2', 'S3'])
+        self.assertEqual([frame['col'].tolist() for frame in workbook.values()], [[0], [1], [2], [3]])
+        with zipfile.ZipFile(output) as package:
+            self.assertIn(b'tabSelected="1"', package.read('xl/worksheets/sheet1.xml'))
+            self.assertNotIn(b'tabSelected="1"', package.read('xl/worksheets/sheet2.xml'))
+
+    def test_load_manifest_rebuilds_when_unreadable(self):
+        mock_s3 = Mock()
+        mock_s3.get_object.side_effect = ClientError({'Error': {'Code': 'AccessDenied'}}, 'GetObject')
+        self.assertEqual(load_manifest(mock_s3, 'test-bucket', 'processed/manifest.json'), {})
+
+        mock_s3.get_object.side_effect = None
+        mock_s3.get_object.return_value = {'Body': io.BytesIO(b'{"sheets": {"A": ')}
+        self.assertEqual(load_manifest(mock_s3, 'test-bucket', 'processed/manifest.json'), {})
+
+    @patch('excel_generator.boto3.client')
+    def test_render_sheet_parts_closes_pipes_on_error(self, mock_boto_client):
+        mock_boto_client.return_value, _ = self._s3_with_objects({f'src/{i}.csv': b'col\n1\n' for i in range(4)})
+        def render(sheet_name, content):
+            raise ValueError('bad sheet')
+        open_fds = len(os.listdir('/proc/self/fd'))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            try:
+                render_sheet_parts([(i, f'S{i}', f'src/{i}.csv') for i in range(4)], render, 'test-bucket', tmpdir, 2)
+            except RuntimeError as error:
+                # The traceback keeps the function's frame, and its connections, alive
+                failure = error
+        self.assertIn('bad sheet', str(failure))
+        self.assertEqual(len(os.listdir('/proc/self/fd')), open_fds)
+
+    def test_s3_multipart_writer_small_object_uses_put_object(self):
+        mock_s3 = Mock()
+        with S3MultipartWriter(mock_s3, 'test-bucket', 'out.xlsx', part_size=10) as writer:
+            writer.write(b'abc')
+            self.assertEqual(writer.tell(), 3)
+
+        mock_s3.put_object.assert_called_once_with(Bucket='test-bucket', Key='out.xlsx', Body=b'abc')
+        mock_s3.create_multipart_upload.assert_not_called()
+
+    def test_s3_multipart_writer_uploads_parts(self):
+        mock_s3 = Mock()
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        mock_s3.upload_part.side_effect = lambda **kwargs: {'ETag': f"etag-{kwargs['PartNumber']}"}
+        with S3MultipartWriter(mock_s3, 'test-bucket', 'out.xlsx', part_size=4) as writer:
+            writer.write(b'abcde')
+            writer.write(b'fg')
+
+        bodies = [kwargs['Body'] for _, kwargs in mock_s3.upload_part.call_args_list]
+        self.assertEqual(bodies, [b'abcde', b'fg'])
+        mock_s3.complete_multipart_upload.assert_called_once_with(
+            Bucket='test-bucket', Key='out.xlsx', UploadId='upload-1',
+            MultipartUpload={'Parts': [{'ETag': 'etag-1', 'PartNumber': 1}, {'ETag': 'etag-2', 'PartNumber': 2}]}
+        )
+        mock_s3.put_object.assert_not_called()
+
+    def test_s3_multipart_writer_aborts_on_error(self):
+        mock_s3 = Mock()
+        mock_s3.create_multipart_upload.return_value = {'UploadId': 'upload-1'}
+        mock_s3.upload_part.return_value = {'ETag': 'etag-1'}
+        with self.assertRaises(ValueError):
+            with S3MultipartWriter(mock_s3, 'test-bucket', 'out.xlsx', part_size=4) as writer:
+                writer.write(b'abcde')
+                raise ValueError("sheet failed")
+
+        mock_s3.abort_multipart_upload.assert_called_once_with(Bucket='test-bucket', Key='out.xlsx', UploadId='upload-1')
+        mock_s3.complete_multipart_upload.assert_not_called()
+
 if __name__ == '__main__':
     unittest.main()
@@ -7,8 +7,10 @@ from typing import List
 import boto3
 import pandas as pd
 import numpy as np
+from structured_logging import log
 
 logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger()
 
 
 def lambda_handler(
@@ -22,7 +24,7 @@ def lambda_handler(
 
     if event:
         try:
-            logging.info("Event: {}".format(event))
+            log(logger, logging.INFO, "Event", event=event)
             file_date = event["file_date"]
             logging.info("File Date: {}".format(file_date))
             
@@ -83,7 +85,7 @@ def lambda_handler(
                 "Status": "Success",
                 "Output": output_dict
             }
-            logging.info("Output: {}".format(response))
+            log(logger, logging.INFO, "Output", status=response["Status"], records=len(output_dict["Records"]))
             return response            
 
         except Exception as error:
@@ -1,29 +1,69 @@
+from __future__ import annotations
 
+import csv
+import gzip
+import hashlib
+import importlib
+import importlib.util
 import logging
+import math
 import os
 import json
+import time
+import threading
+import uuid
+import zipfile
+import xml.etree.ElementTree as ET
 import boto3
-import pandas as pd
-from io import BytesIO
-from snowflake.connector import connect
-from snowflake.connector.pandas_tools import write_pandas
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO, TextIOWrapper
+from urllib.parse import unquote_plus
+from structured_logging import log
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 # Setup logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Heavy dependencies are imported on first use, not at cold start. Keeping them
+# resolvable as module attributes (main.pd, main.serialization) lets callers
+# and tests reach them exactly as before.
+_LAZY_MODULES = {
+    "pd": "pandas",
+    "serialization": "cryptography.hazmat.primitives.serialization",
+}
+
+def __getattr__(name):
+    if name in _LAZY_MODULES:
+        module = importlib.import_module(_LAZY_MODULES[name])
+        globals()[name] = module
+        return module
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def connect(**kwargs):
+    """Opens a Snowflake connection, importing the connector on first use."""
+    from snowflake.connector import connect as snowflake_connect
+    return snowflake_connect(**kwargs)
+
+def write_pandas(**kwargs):
+    """Runs snowflake's write_pandas, importing pandas_tools on first use."""
+    from snowflake.connector.pandas_tools import write_pandas as snowflake_write_pandas
+    return snowflake_write_pandas(**kwargs)
+
 # Decorators for logging
 def log_methods_non_sensitive(func):
     def wrapper(*args, **kwargs):
-        logger.info(f"Calling {func.__name__} with args: {args} and kwargs: {kwargs}")
+        # Arguments are summarized (frames by shape and dtypes) only if the record is emitted
+        log(logger, logging.INFO, f"Calling {func.__name__}", args=args, kwargs=kwargs)
         return func(*args, **kwargs)
     return wrapper
 
 def log_method_sensitive(func):
     def wrapper(*args, **kwargs):
-        logger.info(f"Method: {func.__name__} called.")
+        log(logger, logging.INFO, f"Calling {func.__name__}")
         return func(*args, **kwargs)
     return wrapper
 
@@ -41,6 +81,8 @@ def get_secret(secret_id: str):
 
 # Cryptography operations
 def get_private_key(snowflake_private_key):
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.backends import default_backend
     try:
         p_key = bytes(snowflake_private_key, "utf-8")
         p_key = serialization.load_pem_private_key(p_key, password=None, backend=default_backend())
@@ -53,8 +95,94 @@ def get_private_key(snowflake_private_key):
         logger.error(f"Error loading private key: {e}")
         raise
 
+# SpreadsheetML namespaces used by the header pre-check
+XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+XLSX_REL_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+
+# Recorded as the table comment so an unchanged DDL can be detected
+DDL_FINGERPRINT_PREFIX = "ddl_sha256="
+
+# write_pandas tuning, each value can be pinned with its WRITE_* env var
+WRITE_CHUNK_TARGET_BYTES = 64 * 1024 * 1024
+WRITE_MAX_PARALLEL = 16
+WRITE_ROW_GROUP_ROWS = 100000
+
+# Credential caching
+SECRET_TTL_SECONDS = 900
+# Snowflake errnos raised when the key pair is no longer accepted
+AUTHENTICATION_ERRNOS = (250001, 390100, 390144)
+
+class CredentialCache:
+    """In-process TTL cache of loaded credentials, keyed by secret id.
+
+    Entries are refreshed in the background once they are within
+    refresh_margin of expiry, so warm invocations never wait on Secrets
+    Manager. Nothing is ever written to disk.
+    """
+
+    def __init__(self, loader, ttl=None, refresh_margin=None):
+        self._loader = loader
+        self._ttl = ttl
+        self._refresh_margin = refresh_margin
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _ttl_seconds(self):
+        return self._ttl if self._ttl is not None else int(os.environ.get("SECRET_TTL_SECONDS", SECRET_TTL_SECONDS))
+
+    def _load(self, secret_id):
+        credentials = self._loader(secret_id)
+        with self._lock:
+            self._entries[secret_id] = (credentials, time.time() + self._ttl_seconds())
+            self._refreshing.discard(secret_id)
+        return credentials
+
+    def _refresh(self, secret_id):
+        try:
+            self._load(secret_id)
+        except Exception as e:
+            logger.warning(f"Background credential refresh failed: {e}")
+            with self._lock:
+                self._refreshing.discard(secret_id)
+
+    def get(self, secret_id):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(secret_id)
+        if entry is None or entry[1] <= now:
+            return self._load(secret_id)
+        credentials, expires_at = entry
+        refresh_margin = self._refresh_margin if self._refresh_margin is not None else self._ttl_seconds() / 10
+        with self._lock:
+            start_refresh = expires_at - refresh_margin <= now and secret_id not in self._refreshing
+            if start_refresh:
+                self._refreshing.add(secret_id)
+        if start_refresh:
+            threading.Thread(target=self._refresh, args=(secret_id,), daemon=True).start()
+        return credentials
+
+    def invalidate(self, secret_id=None):
+        with self._lock:
+            if secret_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(secret_id, None)
+
+def load_snowflake_credentials(snowflake_secret_id):
+    snowflake_credentials = get_secret(snowflake_secret_id)
+    return {
+        "user": snowflake_credentials["user"],
+        "private_key": get_private_key(snowflake_credentials["privateKey"])
+    }
+
+_CREDENTIALS = CredentialCache(lambda secret_id: load_snowflake_credentials(secret_id))
+
+def is_authentication_error(error):
+    return getattr(error, "errno", None) in AUTHENTICATION_ERRNOS or "JWT token is invalid" in str(error)
+
 # Snowflake connection
-def connect_to_snowflake(snowflake_user, snowflake_account, private_key, snowflake_schema, snowflake_warehouse, snowflake_database):
+def connect_to_snowflake(snowflake_user, snowflake_account, private_key, snowflake_schema, snowflake_warehouse, snowflake_database, **options):
     try:
         connection = connect(
             user=snowflake_user,
@@ -62,25 +190,297 @@ def connect_to_snowflake(snowflake_user, snowflake_account, private_key, snowfla
             private_key=private_key,
             schema=snowflake_schema,
             warehouse=snowflake_warehouse,
-            database=snowflake_database
+            database=snowflake_database,
+            **options
         )
         return connection
     except Exception as e:
         logger.error(f"Error connecting to Snowflake: {e}")
         raise
 
+# Kept open across warm invocations of the same container.
+_CONNECTION = None
+
+def is_connection_healthy(conn):
+    if conn is None or conn.is_closed():
+        return False
+    try:
+        cur = conn.cursor()
+        try:
+            cur.execute("select 1")
+            cur.fetchone()
+        finally:
+            cur.close()
+        return True
+    except Exception as e:
+        logger.warning(f"Snowflake session failed health check: {e}")
+        return False
+
+def open_snowflake_connection(snowflake_secret_id, snowflake_account, snowflake_schema, snowflake_warehouse, snowflake_database):
+    for attempt in range(2):
+        credentials = _CREDENTIALS.get(snowflake_secret_id)
+        try:
+            return connect_to_snowflake(
+                credentials["user"], snowflake_account, credentials["private_key"], snowflake_schema,
+                snowflake_warehouse, snowflake_database, client_session_keep_alive=True
+            )
+        except Exception as e:
+            if attempt or not is_authentication_error(e):
+                raise
+            # The key may have been rotated since it was cached.
+            logger.warning("Authentication failed with cached credentials, reloading them.")
+            _CREDENTIALS.invalidate(snowflake_secret_id)
+
+def get_snowflake_connection(open_connection):
+    """Returns the container's connection if its session is still alive, else one from open_connection()."""
+    global _CONNECTION
+    start = time.time()
+    if is_connection_healthy(_CONNECTION):
+        logger.info(f"Reusing Snowflake connection, health check took {time.time() - start:.3f}s")
+        return _CONNECTION
+    reset_snowflake_connection()
+    start = time.time()
+    _CONNECTION = open_connection()
+    logger.info(f"Connected to Snowflake in {time.time() - start:.3f}s")
+    return _CONNECTION
+
+def reset_snowflake_connection():
+    """Closes and forgets the cached connection so the next invocation reconnects."""
+    global _CONNECTION
+    if _CONNECTION is not None:
+        try:
+            _CONNECTION.close()
+        except Exception as e:
+            logger.warning(f"Error closing Snowflake connection: {e}")
+    _CONNECTION = None
+
 # Data processing functions
-def create_dataframe_from_s3(bucket, key):
+def resolve_excel_engine(engine=None):
+    """Picks the read_excel engine: EXCEL_ENGINE if set, else calamine when installed, else openpyxl."""
+    engine = engine or os.environ.get("EXCEL_ENGINE", "auto")
+    if engine == "auto":
+        return "calamine" if importlib.util.find_spec("python_calamine") else "openpyxl"
+    return engine
+
+def schema_read_options(schema):
+    """read_excel options that parse only the schema's columns, with its dtypes applied while parsing."""
+    if not schema:
+        return {}
+    return {
+        "usecols": list(schema),
+        # Datetime columns are left to the parser, which already yields datetime64
+        "dtype": {col: dtype for col, dtype in schema.items() if not dtype.startswith("datetime")}
+    }
+
+# A text column becomes categorical when at most this share of its values are distinct
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+def compact_dtypes(df, schema):
+    """Shrinks df in place using the schema's types and returns its memory before and after, in bytes.
+
+    Repeated text becomes categorical and integers are downcast, keeping nullable
+    integers nullable. Parquet stores both with the same logical types as before,
+    so what lands in Snowflake does not change; floats are left alone.
+    """
+    import pandas as pd
+    before = int(df.memory_usage(deep=True).sum())
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        series = df[col]
+        if dtype in ("object", "str", "string"):
+            if len(series) and series.nunique(dropna=True) <= len(series) * CATEGORY_MAX_UNIQUE_RATIO:
+                df[col] = series.astype("category")
+        elif dtype.lower().startswith("int"):
+            df[col] = pd.to_numeric(series, downcast="integer")
+        elif dtype.lower().startswith("uint"):
+            df[col] = pd.to_numeric(series, downcast="unsigned")
+    return before, int(df.memory_usage(deep=True).sum())
+
+def _column_index(cell_reference):
+    """Zero-based column index of a cell reference such as 'AB1'."""
+    index = 0
+    for char in cell_reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+def _first_sheet_path(package):
+    workbook = ET.fromstring(package.read("xl/workbook.xml"))
+    relation_id = workbook.find(f"{XLSX_NS}sheets/{XLSX_NS}sheet").get(f"{XLSX_REL_NS}id")
+    relations = ET.fromstring(package.read("xl/_rels/workbook.xml.rels"))
+    target = next(rel.get("Target") for rel in relations if rel.get("Id") == relation_id)
+    return target.lstrip("/") if target.startswith("/") else f"xl/{target}"
+
+def _shared_strings(package, wanted):
+    """Reads shared strings only up to the highest index in wanted."""
+    strings = {}
+    if not wanted or "xl/sharedStrings.xml" not in package.namelist():
+        return strings
+    last = max(wanted)
+    with package.open("xl/sharedStrings.xml") as shared:
+        for index, (_, elem) in enumerate(
+            (event, elem) for event, elem in ET.iterparse(shared) if elem.tag == f"{XLSX_NS}si"
+        ):
+            if index in wanted:
+                strings[index] = "".join(text.text or "" for text in elem.iter(f"{XLSX_NS}t"))
+            if index >= last:
+                break
+            elem.clear()
+    return strings
+
+def read_excel_header(data):
+    """Reads the first sheet's header row straight from the xlsx XML, without parsing the rest of the sheet."""
+    with zipfile.ZipFile(BytesIO(data)) as package:
+        cells = {}
+        with package.open(_first_sheet_path(package)) as sheet:
+            for _, elem in ET.iterparse(sheet):
+                if elem.tag == f"{XLSX_NS}c":
+                    cell_type = elem.get("t")
+                    if cell_type == "inlineStr":
+                        value = "".join(text.text or "" for text in elem.iter(f"{XLSX_NS}t"))
+                    else:
+                        value_elem = elem.find(f"{XLSX_NS}v")
+                        value = value_elem.text if value_elem is not None else None
+                        if cell_type == "s" and value is not None:
+                            value = int(value)
+                            cell_type = "shared"
+                    # The r attribute is optional, cells without it follow the previous one
+                    reference = elem.get("r")
+                    column = _column_index(reference) if reference else max(cells, default=-1) + 1
+                    cells[column] = (cell_type, value)
+                elif elem.tag == f"{XLSX_NS}row":
+                    break
+        strings = _shared_strings(package, {value for cell_type, value in cells.values() if cell_type == "shared"})
+    header = []
+    for index in range(max(cells) + 1 if cells else 0):
+        cell_type, value = cells.get(index, (None, None))
+        value = strings.get(value) if cell_type == "shared" else value
+        header.append(value if value not in (None, "") else None)
+    # Styled but empty cells past the last header are written out, pandas drops them
+    while header and header[-1] is None:
+        header.pop()
+    return [value if value is not None else f"Unnamed: {index}" for index, value in enumerate(header)]
+
+def validate_header(header, schema):
+    """Checks column names and order against the schema before the workbook is parsed."""
+    try:
+        missing_columns = [col for col in schema if col not in header]
+        new_columns = [col for col in header if col not in schema]
+
+        if missing_columns:
+            raise ValueError(f"Missing columns: {missing_columns}")
+        if new_columns:
+            raise ValueError(f"New columns: {new_columns}")
+        if header != list(schema.keys()):
+            raise ValueError("Column order mismatch")
+
+        return True
+    except Exception as error:
+        logger.error(error)
+        raise error
+
+def download_from_s3(bucket, key):
     try:
         s3 = boto3.client("s3")
         file_obj = s3.get_object(Bucket=bucket, Key=key)
-        data = BytesIO(file_obj["Body"].read())
-        df = pd.read_excel(data)
+        return file_obj["Body"].read()
+    except Exception as error:
+        logger.error(error)
+        raise error
+
+def read_excel_bytes(content, schema=None, engine=None):
+    import pandas as pd
+    try:
+        if schema:
+            # Reject a malformed file from its header before paying for the full parse
+            start = time.time()
+            try:
+                header = read_excel_header(content)
+            except (zipfile.BadZipFile, KeyError, StopIteration, AttributeError, ET.ParseError) as error:
+                logger.warning(f"Header pre-check skipped, not a readable xlsx package: {error}")
+            else:
+                validate_header(header, schema)
+                logger.info(f"Header pre-check passed in {(time.time() - start) * 1000:.1f} ms")
+        data = BytesIO(content)
+        # openpyxl is run by pandas in read_only streaming mode
+        df = pd.read_excel(data, sheet_name=0, engine=resolve_excel_engine(engine), **schema_read_options(schema))
         df.reset_index(drop=True, inplace=True)
         return df
     except Exception as error:
         logger.error(error)
         raise error
+
+def detect_input_format(key, content=b""):
+    """Returns 'parquet', 'csv' or 'excel' from the key's extension, else from the content's magic bytes."""
+    name = key.lower()
+    if name.endswith((".parquet", ".pq")):
+        return "parquet"
+    if name.endswith((".csv", ".csv.gz", ".txt")):
+        return "csv"
+    if name.endswith((".xlsx", ".xlsm", ".xls")):
+        return "excel"
+    if content[:4] == b"PAR1":
+        return "parquet"
+    if content[:2] == b"\x1f\x8b":
+        return "csv"
+    return "excel"
+
+def read_parquet_header(content):
+    """The column names pandas gets from a Parquet file, read from its footer alone."""
+    import pyarrow.parquet as pq
+    arrow_schema = pq.read_schema(BytesIO(content))
+    index_columns = (arrow_schema.pandas_metadata or {}).get("index_columns", [])
+    return [name for name in arrow_schema.names if name not in index_columns]
+
+def read_csv_header(content):
+    """The column names pandas gets from a CSV file, read from its first line alone."""
+    compressed = content[:2] == b"\x1f\x8b"
+    with (gzip.open(BytesIO(content)) if compressed else BytesIO(content)) as data:
+        header = next(csv.reader(TextIOWrapper(data, encoding="utf-8-sig", newline="")), [])
+    return [name if name else f"Unnamed: {index}" for index, name in enumerate(header)]
+
+def read_parquet_bytes(content, schema=None):
+    import pyarrow.parquet as pq
+    try:
+        if schema:
+            # Checked before the projection below, which would silently drop new or reordered columns
+            validate_header(read_parquet_header(content), schema)
+        table = pq.read_table(BytesIO(content), columns=list(schema) if schema else None)
+        # Arrow buffers are handed to pandas without an extra copy where the types allow it
+        df = table.to_pandas(split_blocks=True, self_destruct=True)
+        return df
+    except Exception as error:
+        logger.error(error)
+        raise error
+
+def read_csv_bytes(content, schema=None):
+    import pandas as pd
+    try:
+        options = schema_read_options(schema)
+        if schema:
+            # Checked before usecols drops new columns and reorders the rest
+            validate_header(read_csv_header(content), schema)
+            options["parse_dates"] = [col for col, dtype in schema.items() if dtype.startswith("datetime")]
+        compression = "gzip" if content[:2] == b"\x1f\x8b" else None
+        df = pd.read_csv(BytesIO(content), compression=compression, keep_default_na=True, **options)
+        return df
+    except Exception as error:
+        logger.error(error)
+        raise error
+
+def read_input_bytes(content, key, schema=None):
+    """Parses a downloaded file with the reader for its format."""
+    input_format = detect_input_format(key, content)
+    if input_format == "parquet":
+        return read_parquet_bytes(content, schema)
+    if input_format == "csv":
+        return read_csv_bytes(content, schema)
+    return read_excel_bytes(content, schema)
+
+def create_dataframe_from_s3(bucket, key, schema=None, engine=None):
+    return read_excel_bytes(download_from_s3(bucket, key), schema, engine)
     
 def fetch_schema_from_s3(bucket, key):
     try:
@@ -113,48 +513,377 @@ def validate_df_schema(df, schema):
         logger.error(error)
         raise error
 
-def transform_data(df: pd.DataFrame):
-    try:
-        df.columns = [col.upper().replace(' (%)', '_PCT').replace(' ($)', '').replace(' ', '_') for col in df.columns]
-        df['YYYY'] = pd.to_datetime('today').year
-        df['MM'] = pd.to_datetime('today').month
-        df['DD'] = pd.to_datetime('today').day
-        df = df[~df.iloc[:, 0].str.contais('Total', na=False)]
+# Transform applied when no TRANSFORM_PLAN_KEY is configured
+DEFAULT_TRANSFORM_PLAN = {
+    "rename": {"upper": True, "replace": [[" (%)", "_PCT"], [" ($)", ""], [" ", "_"]]},
+    "partition": {"YYYY": "year", "MM": "month", "DD": "day"},
+    "filters": [{"column": 0, "op": "not_contains", "value": "Total"}]
+}
+# Load date parts a partition column can be derived from
+PARTITION_PARTS = {
+    "year": lambda today: today.year,
+    "month": lambda today: today.month,
+    "day": lambda today: today.day,
+    "date": lambda today: today.strftime("%Y-%m-%d"),
+}
+FILTER_OPS = ("contains", "not_contains", "equals", "not_equals", "not_null")
+
+# Compiled transform plans per (bucket, key), fetched from S3 once per container
+_TRANSFORM_PLANS = {}
+
+def sql_literal(value):
+    if isinstance(value, str):
+        return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    return str(value)
+
+class TransformPlan:
+    """A transform config compiled once into vectorized steps: row filters, column renames and
+    derived partition columns, applied to a frame in one pass.
+
+    The config is a JSON object kept next to the schema:
+        rename: {"columns": {source: target}, "upper": bool, "replace": [[old, new], ...]}
+        partition: {column: "year" | "month" | "day" | "date"}, stamped from the load date
+        filters: [{"column": name or position, "op": one of FILTER_OPS, "value": str}], rows are kept when all match
+    """
+
+    def __init__(self, config):
+        rename = config.get("rename", {})
+        self._columns = dict(rename.get("columns", {}))
+        self._upper = bool(rename.get("upper", False))
+        self._replace = [(old, new) for old, new in rename.get("replace", [])]
+        unknown = {part for part in config.get("partition", {}).values() if part not in PARTITION_PARTS}
+        if unknown:
+            raise ValueError(f"Unknown partition parts: {sorted(unknown)}")
+        self.partition = dict(config.get("partition", {}))
+        self.filters = []
+        for rule in config.get("filters", []):
+            if rule.get("op") not in FILTER_OPS:
+                raise ValueError(f"Unknown filter op: {rule.get('op')}")
+            self.filters.append((rule["column"], rule["op"], rule.get("value")))
+        self._names = {}
+
+    def target_name(self, col):
+        """The Snowflake column a source column is loaded into."""
+        if col not in self._names:
+            name = self._columns.get(col)
+            if name is None:
+                name = col.upper() if self._upper else col
+                for old, new in self._replace:
+                    name = name.replace(old, new)
+            self._names[col] = name
+        return self._names[col]
+
+    def partition_values(self, today=None):
+        """{column: value} for the partition columns, derived from today's date unless given one."""
+        import pandas as pd
+        today = pd.Timestamp.today() if today is None else today
+        return {col: PARTITION_PARTS[part](today) for col, part in self.partition.items()}
+
+    def _source_column(self, column, source_columns):
+        return source_columns[column] if isinstance(column, int) else column
+
+    def row_mask(self, df):
+        """Boolean array of the rows every filter keeps, or None when there are no filters."""
+        import numpy as np
+        import pandas as pd
+        mask = None
+        for column, op, value in self.filters:
+            series = df.iloc[:, column] if isinstance(column, int) else df[column]
+            if op == "not_null":
+                keep = series.notna().to_numpy()
+            elif isinstance(series.dtype, pd.CategoricalDtype):
+                # Evaluated once per category, then broadcast through the codes; missing values never match
+                categories = series.cat.categories.astype(str)
+                hits = categories.str.contains(value, regex=False) if op.endswith("contains") else categories == value
+                keep = np.append(np.asarray(hits, dtype=bool), False)[series.cat.codes.to_numpy()]
+            elif op.endswith("contains"):
+                keep = series.astype("string").str.contains(value, regex=False).fillna(False).to_numpy(dtype=bool)
+            else:
+                keep = (series.astype("string") == value).fillna(False).to_numpy(dtype=bool)
+            if op.startswith("not_") and op != "not_null":
+                keep = ~keep
+            mask = keep if mask is None else mask & keep
+        return mask
+
+    def sql_filter(self, source_columns, column_ref):
+        """The filters as a SQL predicate over column_ref(source column), or None when there are none."""
+        predicates = []
+        for column, op, value in self.filters:
+            ref = column_ref(self._source_column(column, source_columns))
+            if op == "not_null":
+                predicates.append(f"{ref} is not null")
+            elif op == "contains":
+                predicates.append(f"contains({ref}::string, {sql_literal(value)})")
+            elif op == "not_contains":
+                predicates.append(f"not contains(coalesce({ref}::string, ''), {sql_literal(value)})")
+            elif op == "equals":
+                predicates.append(f"{ref}::string = {sql_literal(value)}")
+            else:
+                predicates.append(f"({ref} is null or {ref}::string <> {sql_literal(value)})")
+        return " and ".join(predicates) or None
+
+    def apply(self, df, partition_values=None):
+        """Filters, renames and stamps the partition columns on df, copying the rows at most once."""
+        import pandas as pd
+        mask = self.row_mask(df)
+        if mask is not None and not mask.all():
+            df = df[mask]
+            df.index = pd.RangeIndex(len(df))
+        df.columns = [self.target_name(col) for col in df.columns]
+        for col, value in (self.partition_values() if partition_values is None else partition_values).items():
+            df[col] = value
         return df
+
+def fetch_transform_plan(bucket=None, key=None):
+    """The compiled plan stored at s3://bucket/key, or the default plan when there is no key."""
+    if (bucket, key) not in _TRANSFORM_PLANS:
+        try:
+            config = DEFAULT_TRANSFORM_PLAN
+            if key:
+                obj = boto3.client("s3").get_object(Bucket=bucket, Key=key)
+                config = json.load(BytesIO(obj["Body"].read()))
+            _TRANSFORM_PLANS[(bucket, key)] = TransformPlan(config)
+        except Exception as error:
+            logger.error(error)
+            raise error
+    return _TRANSFORM_PLANS[(bucket, key)]
+
+def transform_data(df: pd.DataFrame, plan=None, partition_values=None):
+    try:
+        return (plan or fetch_transform_plan()).apply(df, partition_values)
     except Exception as error:
         logger.error(error)
         raise error
     
-def create_table_in_snowflake(conn, bucket, table_ddl_key, database, schema, table):
-    try:
+# Seconds between status checks of an async Snowflake query
+QUERY_POLL_SECONDS = 0.2
+# Longest an async Snowflake query is waited on before the load gives up
+QUERY_TIMEOUT_SECONDS = 600
+
+# Rendered DDL per target, fetched from S3 once per container
+_DDL_CACHE = {}
+# Targets already checked against their DDL in this container
+_VERIFIED_TABLES = set()
+
+def render_table_ddl(bucket, table_ddl_key, database, schema, table):
+    cache_key = (bucket, table_ddl_key, database, schema, table)
+    if cache_key not in _DDL_CACHE:
         s3 = boto3.client('s3')
-        
         obj = s3.get_object(Bucket=bucket, Key=table_ddl_key)
-        
         script = obj['Body'].read().decode('utf-8')
-        
         script = script.replace('@database', database).replace('@schema', schema).replace('@table', table)
-        
         logger.info(f"Script fetched from S3: {script}")
+        _DDL_CACHE[cache_key] = (script, hashlib.sha256(script.encode('utf-8')).hexdigest())
+    return _DDL_CACHE[cache_key]
+
+def get_table_ddl_fingerprint(conn, database, schema, table):
+    """Returns the fingerprint recorded on the table, '' if it has none, or None if the table is missing."""
+    cur = conn.cursor()
+    cur.execute(
+        f"select comment from {database}.information_schema.tables where table_schema = %s and table_name = %s",
+        (schema.upper(), table.upper())
+    )
+    row = cur.fetchone()
+    if row is None:
+        return None
+    comment = row[0] or ""
+    return comment[len(DDL_FINGERPRINT_PREFIX):] if comment.startswith(DDL_FINGERPRINT_PREFIX) else ""
+
+# Prefix of every QUERY_TAG the loader sets, followed by run id, stage and files
+QUERY_TAG_PREFIX = "snowflake_connector"
+# Snowflake caps QUERY_TAG at 2000 characters
+QUERY_TAG_MAX_LENGTH = 2000
+
+def query_tag(run_id, stage, files=()):
+    return f"{QUERY_TAG_PREFIX}:{run_id}:{stage}:{','.join(files)}"[:QUERY_TAG_MAX_LENGTH]
+
+def set_query_tag(conn, tag):
+    """Tags every following statement of the session, including the ones write_pandas runs."""
+    conn.cursor().execute("alter session set query_tag = %s", (tag,))
+
+def emit_metric(name, **fields):
+    """Logs a metric as one JSON line so it can be filtered and graphed from CloudWatch Logs."""
+    log(logger, logging.INFO, "Metric", metric=name, **fields)
+
+def fetch_query_metrics(conn, run_id):
+    """Returns query id, type, timings, rows and bytes of every statement this run tagged in the session."""
+    cur = conn.cursor()
+    cur.execute(
+        "select query_id, query_tag, query_type, execution_status, total_elapsed_time, queued_provisioning_time,"
+        " rows_produced, bytes_scanned"
+        " from table(information_schema.query_history_by_session(result_limit => 1000))"
+        " where startswith(query_tag, %s) and query_type <> 'ALTER_SESSION' order by start_time",
+        (f"{QUERY_TAG_PREFIX}:{run_id}:",)
+    )
+    fields = ("query_id", "query_tag", "query_type", "status", "elapsed_ms", "queued_provisioning_ms", "rows", "bytes_scanned")
+    return [dict(zip(fields, row)) for row in cur.fetchall()]
+
+def submit_async(conn, statement):
+    """Submits a statement with execute_async and returns its query id without waiting for it."""
+    cur = conn.cursor()
+    cur.execute_async(statement)
+    return cur.sfqid
+
+def wait_for_queries(conn, query_ids, timeout=None):
+    """Polls async queries until they finish, raising the error of the first one that failed.
+
+    Raises TimeoutError when they are still running after timeout seconds.
+    """
+    timeout = timeout if timeout is not None else float(os.environ.get("QUERY_TIMEOUT_SECONDS", QUERY_TIMEOUT_SECONDS))
+    deadline = time.time() + timeout
+    for query_id in query_ids:
+        while conn.is_still_running(conn.get_query_status_throw_if_error(query_id)):
+            if time.time() >= deadline:
+                raise TimeoutError(f"Snowflake query {query_id} still running after {timeout:.0f}s")
+            time.sleep(QUERY_POLL_SECONDS)
+
+def create_table_in_snowflake(conn, bucket, table_ddl_key, database, schema, table, asynchronous=False):
+    """Runs the table DDL only when the table is missing or was created from a different DDL.
+
+    With asynchronous=True the DDL is submitted with execute_async and a
+    callable is returned that waits for it and records the fingerprint; it
+    must be called before the table is written to.
+    """
+    try:
+        cache_key = (bucket, table_ddl_key, database, schema, table)
+        if cache_key in _VERIFIED_TABLES:
+            logger.info(f"Table already verified in this container: {table}")
+            return lambda: None
         
-        cur = conn.cursor()
+        script, fingerprint = render_table_ddl(bucket, table_ddl_key, database, schema, table)
+        
+        if get_table_ddl_fingerprint(conn, database, schema, table) == fingerprint:
+            logger.info(f"Table matches its DDL, skipping DDL: {table}")
+            _VERIFIED_TABLES.add(cache_key)
+            return lambda: None
+        
+        def record_fingerprint():
+            conn.cursor().execute(f"comment on table {database}.{schema}.{table} is '{DDL_FINGERPRINT_PREFIX}{fingerprint}'")
+            logger.info(f"Table created in Snowflake: {table}")
+            _VERIFIED_TABLES.add(cache_key)
         
-        cur.execute(script)
+        if not asynchronous:
+            cur = conn.cursor()
+            
+            cur.execute(script)
+            record_fingerprint()
+            return lambda: None
+        
+        query_id = submit_async(conn, script)
+        logger.info(f"Submitted table DDL for {table} as query {query_id}")
         
-        logger.info(f"Table created in Snowflake: {table}")
+        def wait_for_table():
+            if cache_key not in _VERIFIED_TABLES:
+                wait_for_queries(conn, [query_id])
+                record_fingerprint()
+        return wait_for_table
         
     except Exception as error:
         logger.error(error)
         raise error
     
-def write_df_to_snowflake(df, table, database, schema, conn):
+def write_pandas_options(df):
+    """Sizes write_pandas chunks, PUT threads, codec and Parquet row groups from the frame.
+
+    Chunks target WRITE_CHUNK_TARGET_BYTES of in-memory data so large loads are
+    split into many files that are PUT in parallel and COPied by Snowflake
+    concurrently. Small frames go up gzipped, large ones snappy to keep the
+    encode off the critical path.
+    """
+    rows = len(df)
+    frame_bytes = int(df.memory_usage(deep=True).sum()) if rows else 0
+    chunk_size = int(os.environ.get("WRITE_CHUNK_ROWS", 0))
+    if not chunk_size:
+        chunk_size = max(1, math.ceil(rows * WRITE_CHUNK_TARGET_BYTES / frame_bytes)) if frame_bytes else max(rows, 1)
+    chunks = max(1, math.ceil(rows / chunk_size))
+    return {
+        "chunk_size": chunk_size,
+        "parallel": int(os.environ.get("WRITE_PARALLEL", 0)) or min(chunks, WRITE_MAX_PARALLEL),
+        "compression": os.environ.get("WRITE_COMPRESSION") or ("snappy" if frame_bytes > WRITE_CHUNK_TARGET_BYTES else "gzip"),
+        "row_group_size": int(os.environ.get("WRITE_ROW_GROUP_SIZE", 0)) or min(chunk_size, WRITE_ROW_GROUP_ROWS),
+    }
+
+def timed_write_pandas(df, table, **kwargs):
+    """Runs write_pandas with the tuned options and logs its timing and the COPY result of every file."""
+    options = write_pandas_options(df)
+    logger.info(f"Uploading {len(df)} rows to {table} with {options}")
+    start = time.time()
+    response = write_pandas(df=df, table_name=table, **options, **kwargs)
+    elapsed = time.time() - start
+    if len(response) > 3:
+        # COPY INTO reports one row per chunk file: file, status, rows_parsed, rows_loaded, ...
+        for copy_result in response[3]:
+            logger.info(f"COPY {table}: {copy_result[:4]}")
+        logger.info(f"write_pandas loaded {response[2]} rows in {response[1]} chunks in {elapsed:.2f}s")
+    else:
+        logger.info(f"write_pandas finished in {elapsed:.2f}s")
+    return response
+
+def load_df_via_staging(df, table, database, schema, conn, wait_for_table=None, tag_stage=None, partition_columns=None):
+    """Loads df into a temporary staging table, then replaces its date partitions in one transaction.
+
+    The staging table is overwritten on every attempt and the target only
+    changes when the transaction commits, so a failed load can simply be retried.
+    A pending table DDL keeps running server-side while the stage is uploaded.
+    """
+    stage_table = f"{table}_STAGE"
+    target = f"{database}.{schema}.{table}"
+    stage = f"{database}.{schema}.{stage_table}"
+    columns = ", ".join(f'"{col}"' for col in df.columns)
+    partition_columns = list(fetch_transform_plan().partition) if partition_columns is None else partition_columns
+    tag_stage = tag_stage or (lambda stage: None)
+    cur = conn.cursor()
     try:
-        cur = conn.cursor()
+        logger.info(f"Staging data for Snowflake table: {table}")
+        tag_stage("stage")
+        response = timed_write_pandas(
+            df, stage_table, conn=conn, schema=schema, database=database,
+            auto_create_table=True, table_type="temporary", overwrite=True
+        )
+        if not response[0]:
+            raise ValueError(f"Error staging data for Snowflake table: {table}")
+        if wait_for_table:
+            wait_for_table()
+
+        tag_stage("swap")
+        cur.execute("begin")
+        if partition_columns:
+            cur.execute(
+                f"delete from {target} using (select distinct {', '.join(partition_columns)} from {stage}) partitions where "
+                + " and ".join(f"{target}.{col} = partitions.{col}" for col in partition_columns)
+            )
+        else:
+            cur.execute(f"delete from {target}")
+        cur.execute(f"insert into {target} ({columns}) select {columns} from {stage}")
+        cur.execute("commit")
+        logger.info(f"Data written to Snowflake table: {table}")
+    except Exception as error:
+        logger.error(error)
+        cur.execute("rollback")
+        raise error
+
+def partition_predicate(partition_values):
+    """SQL predicate selecting the rows of one partition, every row for a table without partition columns."""
+    return " and ".join(f"{col}={sql_literal(value)}" for col, value in partition_values.items()) or "true"
+
+def write_df_to_snowflake(df, table, database, schema, conn, wait_for_table=None, tag_stage=None, partition_columns=None):
+    partition_columns = list(fetch_transform_plan().partition) if partition_columns is None else partition_columns
+    if os.environ.get("LOAD_MODE", "direct") == "staged":
+        return load_df_via_staging(df, table, database, schema, conn, wait_for_table, tag_stage, partition_columns)
+    tag_stage = tag_stage or (lambda stage: None)
+    try:
+        if wait_for_table:
+            wait_for_table()
         
         logger.info(f"Writing to Snowflake table: {table}")
-        cur.execute(f" delete from {database}.{schema}.{table} where YYYY={df['YYYY'][0]} and MM={df['MM'][0]} and DD={df['DD'][0]}")
+        tag_stage("delete")
+        # Blocking on purpose: write_pandas copies as soon as its chunks are uploaded,
+        # so the delete has to finish first or it could remove freshly copied rows
+        partition = {col: df[col].iloc[0] for col in partition_columns}
+        conn.cursor().execute(f" delete from {database}.{schema}.{table} where {partition_predicate(partition)}")
         
-        response = write_pandas(conn=conn, df=df, table_name=table, schema=schema, database=database)
+        tag_stage("copy")
+        response = timed_write_pandas(df, table, conn=conn, schema=schema, database=database)
         
         if response[0]==True:
             logger.info(f"Data written to Snowflake table: {table}")
@@ -173,11 +902,264 @@ def publish_to_sns(sns_arn, subject, message):
         logger.error(error)
         raise error
     
+# Files downloaded and parsed at once when an event carries several records
+RECORD_WORKERS = 4
+
+def iter_s3_records(event, message_id=None):
+    """Yields (bucket, key, etag, message_id) for every S3 record, unwrapping S3 notifications replayed
+    through SQS. message_id is the SQS message the record came in, None for direct S3 notifications.
+    """
+    for record in event.get('Records', []):
+        if 'body' in record:
+            yield from iter_s3_records(json.loads(record['body']), record.get('messageId'))
+        elif 's3' in record:
+            s3_object = record['s3']['object']
+            yield record['s3']['bucket']['name'], unquote_plus(s3_object['key']), s3_object.get('eTag'), message_id
+
+# Content hashes of the latest load this container committed, per (database, schema, table, partition)
+_COMMITTED_LOADS = {}
+# Control tables already created in this container
+_AUDIT_TABLES = set()
+
+def partition_key(partition):
+    """Audit table key of a ((column, value), ...) partition."""
+    return "/".join(f"{col}={value}" for col, value in partition)
+
+def content_hash(event_bucket, event_key, etag=None):
+    """The object's ETag, taken from the event when it carries one."""
+    if not etag:
+        etag = boto3.client("s3").head_object(Bucket=event_bucket, Key=event_key)["ETag"]
+    return etag.strip('"')
+
+def ensure_audit_table(conn, database, schema, audit_table):
+    if (database, schema, audit_table) not in _AUDIT_TABLES:
+        conn.cursor().execute(
+            f"create table if not exists {database}.{schema}.{audit_table} (TARGET_TABLE string, PARTITION_KEY string,"
+            " CONTENT_HASH string, S3_KEY string, RUN_ID string, LOADED_AT timestamp_ltz default current_timestamp())"
+        )
+        _AUDIT_TABLES.add((database, schema, audit_table))
+
+def committed_hashes(conn, database, schema, table, partition, audit_table=None):
+    """Content hashes of the latest load committed to the partition.
+
+    Read from the audit_table control table when there is one, so loads by
+    other containers count, else from this container's own cache.
+    """
+    if not audit_table:
+        return _COMMITTED_LOADS.get((database, schema, table, partition), set())
+    ensure_audit_table(conn, database, schema, audit_table)
+    audit = f"{database}.{schema}.{audit_table}"
+    where = "target_table = %s and partition_key = %s"
+    cur = conn.cursor()
+    cur.execute(
+        f"select content_hash from {audit} where {where} and run_id = "
+        f"(select run_id from {audit} where {where} order by loaded_at desc limit 1)",
+        (table, partition_key(partition)) * 2
+    )
+    return {row[0] for row in cur.fetchall()}
+
+def is_duplicate_load(conn, database, schema, table, partition, hashes, audit_table=None):
+    """True when every file of the event is part of the latest load committed to the partition.
+
+    The partition then already holds the content of every file in the event,
+    so the event is skipped. Reloading it would not be a no-op when it is a
+    strict subset of that load: the partition would be replaced by its files
+    alone, dropping the rows of the load's other files.
+    """
+    start = time.time()
+    duplicate = bool(hashes) and set(hashes) <= committed_hashes(conn, database, schema, table, partition, audit_table)
+    logger.info(f"Duplicate check for {table} {partition} took {(time.time() - start) * 1000:.1f} ms: {duplicate}")
+    return duplicate
+
+def check_duplicate_event(connection_future, hashes_future, database, schema, table, partition, audit_table=None):
+    """Runs is_duplicate_load once the hashes are ready. A failed check never blocks the load.
+
+    The connection is only waited on when the check reads the audit_table, the
+    container's own cache needs none.
+    """
+    try:
+        conn = connection_future.result()[0] if audit_table else None
+        return is_duplicate_load(conn, database, schema, table, partition, hashes_future.result().values(), audit_table)
+    except Exception as e:
+        logger.warning(f"Duplicate check failed, loading anyway: {e}")
+        return False
+
+def record_committed_load(conn, database, schema, table, partition, hashes_by_key, run_id, audit_table=None):
+    """Remembers the content hashes of a committed load, in the control table when there is one."""
+    _COMMITTED_LOADS[(database, schema, table, partition)] = set(hashes_by_key.values())
+    if audit_table:
+        ensure_audit_table(conn, database, schema, audit_table)
+        conn.cursor().executemany(
+            f"insert into {database}.{schema}.{audit_table} (TARGET_TABLE, PARTITION_KEY, CONTENT_HASH, S3_KEY, RUN_ID)"
+            " values (%s, %s, %s, %s, %s)",
+            [(table, partition_key(partition), content, key, run_id) for key, content in hashes_by_key.items()]
+        )
+
+def prepare_record(event_bucket, event_key, get_schema, timings=None, duplicate=None, plan=None, partition_values=None):
+    """Downloads, parses and transforms one file with plan. get_schema blocks until the schema is fetched,
+    so the download never waits on it. Step durations in ms are recorded in timings.
+
+    Returns None when the duplicate future has already resolved to True. The
+    check is never waited on: the file is parsed speculatively and the caller
+    drops the result if the event turns out to be a duplicate.
+    """
+    timings = {} if timings is None else timings
+    if duplicate is not None and duplicate.done() and duplicate.result():
+        return None
+    start = time.time()
+    content = download_from_s3(event_bucket, event_key)
+    if duplicate is not None and duplicate.done() and duplicate.result():
+        return None
+    timings["download_ms"] = round((time.time() - start) * 1000, 1)
+    timings["bytes"] = len(content)
+    schema = get_schema()
+    if parquet_direct_load_enabled() and detect_input_format(event_key, content) == "parquet":
+        staged = StagedParquet.from_content(event_bucket, event_key, content, schema, plan, partition_values)
+        if staged is not None:
+            logger.info(f"s3://{event_bucket}/{event_key} matches the schema, loading it straight from the stage")
+            return staged
+    return prepare_frame(event_bucket, event_key, content, schema, timings, plan, partition_values)
+
+def prepare_frame(event_bucket, event_key, content, schema, timings=None, plan=None, partition_values=None):
+    """Parses, validates, compacts and transforms one downloaded file."""
+    timings = {} if timings is None else timings
+    start = time.time()
+    df = read_input_bytes(content, event_key, schema)
+    timings["parse_ms"] = round((time.time() - start) * 1000, 1)
+    if not validate_df_schema(df, schema):
+        logger.info("Schema validation failed.")
+        raise ValueError("Schema validation failed.")
+    if os.environ.get("COMPACT_DTYPES", "true").lower() == "true":
+        timings["memory_bytes"], timings["compact_memory_bytes"] = compact_dtypes(df, schema)
+        logger.info(
+            f"Compacted s3://{event_bucket}/{event_key} from {timings['memory_bytes']} to "
+            f"{timings['compact_memory_bytes']} bytes, saving {timings['memory_bytes'] - timings['compact_memory_bytes']}"
+        )
+    start = time.time()
+    df = transform_data(df, plan, partition_values)
+    timings["transform_ms"] = round((time.time() - start) * 1000, 1)
+    return df
+
+# Snowflake types the staged Parquet columns are cast to, by schema dtype prefix
+PARQUET_SQL_TYPES = (("datetime", "timestamp_ntz"), ("int", "number"), ("uint", "number"), ("float", "float"), ("bool", "boolean"))
+
+def parquet_direct_load_enabled():
+    """Direct loads need an external stage on the event bucket's root and a named Parquet file format."""
+    return bool(os.environ.get("SNOWFLAKE_EXTERNAL_STAGE") and os.environ.get("SNOWFLAKE_PARQUET_FILE_FORMAT"))
+
+class StagedParquet:
+    """A Parquet file that matches the schema and is loaded from the external stage, never through pandas."""
+
+    def __init__(self, bucket, key, content, schema, num_rows, plan=None, partition_values=None):
+        self.bucket = bucket
+        self.key = key
+        self.content = content
+        self.schema = schema
+        self.num_rows = num_rows
+        self.plan = plan or fetch_transform_plan()
+        self.partition_values = self.plan.partition_values() if partition_values is None else partition_values
+
+    def __len__(self):
+        return self.num_rows
+
+    @classmethod
+    def from_content(cls, bucket, key, content, schema, plan=None, partition_values=None):
+        """Reads only the footer; returns None unless the columns are exactly the schema's, in order."""
+        import pyarrow.parquet as pq
+        metadata = pq.read_metadata(BytesIO(content))
+        if metadata.schema.to_arrow_schema().names != list(schema):
+            return None
+        return cls(bucket, key, content, schema, metadata.num_rows, plan, partition_values)
+
+    def to_frame(self, timings=None):
+        """Falls back to the pandas path, for events that mix staged and parsed files."""
+        return prepare_frame(self.bucket, self.key, self.content, self.schema, timings, self.plan, self.partition_values)
+
+    def target_columns(self):
+        """The Snowflake columns select_sql returns, in order."""
+        return [self.plan.target_name(col) for col in self.schema] + list(self.partition_values)
+
+    def select_sql(self, stage, file_format):
+        columns = []
+        for col, dtype in self.schema.items():
+            sql_type = next((sql_type for prefix, sql_type in PARQUET_SQL_TYPES if dtype.lower().startswith(prefix)), "string")
+            columns.append(f'$1:"{col}"::{sql_type}')
+        columns += [sql_literal(value) for value in self.partition_values.values()]
+        path = f"@{stage}/{self.key}".replace("'", "\\'")
+        # The plan's filters, evaluated by Snowflake instead of transform_data
+        where = self.plan.sql_filter(list(self.schema), lambda col: f'$1:"{col}"')
+        return (
+            f"select {', '.join(columns)} from '{path}' (file_format => '{file_format}')"
+            + (f" where {where}" if where else "")
+        )
+
+def load_parquet_via_copy(staged_files, table, database, schema, conn, wait_for_table=None, tag_stage=None):
+    """Replaces the partition with the staged Parquet files in one transaction, reading them server-side."""
+    tag_stage = tag_stage or (lambda stage: None)
+    stage = os.environ["SNOWFLAKE_EXTERNAL_STAGE"]
+    file_format = os.environ["SNOWFLAKE_PARQUET_FILE_FORMAT"]
+    target = f"{database}.{schema}.{table}"
+    columns = ", ".join(f'"{col}"' for col in staged_files[0].target_columns())
+    cur = conn.cursor()
+    try:
+        if wait_for_table:
+            wait_for_table()
+        tag_stage("copy")
+        cur.execute("begin")
+        cur.execute(f"delete from {target} where {partition_predicate(staged_files[0].partition_values)}")
+        cur.execute(
+            f"insert into {target} ({columns}) "
+            + " union all ".join(staged.select_sql(stage, file_format) for staged in staged_files)
+        )
+        cur.execute("commit")
+        logger.info(f"Data copied from {len(staged_files)} staged Parquet file(s) to Snowflake table: {table}")
+    except Exception as error:
+        logger.error(error)
+        cur.execute("rollback")
+        raise error
+
+def discard_snowflake_session(error):
+    """Drops the cached session after a Snowflake error so the next invocation starts clean."""
+    if type(error).__module__.startswith("snowflake."):
+        reset_snowflake_connection()
+        # The table may have been dropped or altered, check it again next time
+        _VERIFIED_TABLES.clear()
+
+def connect_and_submit_ddl(open_connection, bucket, table_ddl_key, database, schema, table, run_id):
+    """Connects and submits the table DDL asynchronously. Returns the connection and the DDL's wait callable."""
+    conn = get_snowflake_connection(open_connection)
+    set_query_tag(conn, query_tag(run_id, "ddl"))
+    return conn, create_table_in_snowflake(conn, bucket, table_ddl_key, database, schema, table, asynchronous=True)
+
+def load_partitions(frames, snowflake_table, snowflake_database, snowflake_schema, conn, wait_for_table=None, run_id=None,
+                    partition_columns=None):
+    """Loads the prepared frames as one batch per partition. Returns {key: error} for failed loads."""
+    import pandas as pd
+    partition_columns = list(fetch_transform_plan().partition) if partition_columns is None else partition_columns
+    partitions = {}
+    for key, df in frames.items():
+        # Frames whose rows were all filtered out have no partition to replace
+        partition = tuple(df[col].iloc[0] for col in partition_columns) if len(df) else None
+        partitions.setdefault(partition, []).append(key)
+    errors = {}
+    partitions.pop(None, None)
+    for partition, keys in partitions.items():
+        df = frames[keys[0]] if len(keys) == 1 else pd.concat([frames[key] for key in keys], ignore_index=True)
+        try:
+            write_df_to_snowflake(
+                df, snowflake_table, snowflake_database, snowflake_schema, conn, wait_for_table,
+                lambda stage: set_query_tag(conn, query_tag(run_id, stage, [key for _, key in keys])),
+                partition_columns
+            )
+        except Exception as e:
+            logger.error(f"Error loading partition {partition}: {e}")
+            errors.update({key: e for key in keys})
+    return errors
+
 def lambda_handler(event, context):
     if event:
-        logger.info(f"Event: {event}")
+        log(logger, logging.INFO, "Event", event=event)
         try:
-            logger.info(f"Envrinment variables: {os.environ}")
             
             snowflake_secret_id = os.environ["SNOWFLAKE_SECRET_ID"]
             bucket= os.environ["BUCKET"]
@@ -188,36 +1170,154 @@ def lambda_handler(event, context):
             snowflake_warehouse = os.environ["SNOWFLAKE_WAREHOUSE"]
             snowflake_account = os.environ["SNOWFLAKE_ACCOUNT"]
             create_table_query_key = os.environ["CREATE_TABLE_QUERY_KEY"]
-            
-            # Getting snowflake credentials
-            snowflake_credentials = get_secret(snowflake_secret_id)
-            snowflake_user = snowflake_credentials["user"]
-            snowflake_private_key = get_private_key(snowflake_credentials["privateKey"])
-            
-            # Connecting to snowflake
-            conn = connect_to_snowflake(snowflake_user, snowflake_account, snowflake_private_key, snowflake_schema, snowflake_warehouse, snowflake_database)
+            log(logger, logging.INFO, "Configuration", table=snowflake_table, schema=snowflake_schema,
+                database=snowflake_database, warehouse=snowflake_warehouse, load_mode=os.environ.get("LOAD_MODE", "direct"))
             
             # Fetching details from event
-            event_bucket = event['Records'][0]['s3']['bucket']['name']
-            event_key = event['Records'][0]['s3']['object']['key']
+            etags, messages = {}, {}
+            for event_bucket, event_key, etag, message_id in iter_s3_records(event):
+                etags[(event_bucket, event_key)] = etag
+                if message_id:
+                    messages.setdefault((event_bucket, event_key), []).append(message_id)
+            records = list(etags)
+            if not records:
+                raise ValueError("Event has no S3 object records.")
+            audit_table = os.environ.get("LOAD_AUDIT_TABLE")
+            # Compiled once per container, the date parts are taken once per invocation
+            plan = fetch_transform_plan(bucket, os.environ.get("TRANSFORM_PLAN_KEY"))
+            partition_values = plan.partition_values()
+            partition = tuple(partition_values.items())
+            # Ties the QUERY_TAG of every statement back to this invocation
+            run_id = getattr(context, "aws_request_id", None) or uuid.uuid4().hex
             
-            df = create_dataframe_from_s3(event_bucket, event_key)
+            # Connecting to snowflake, submitting the table DDL and fetching the schema run alongside the
+            # file downloads and parses, credentials are only fetched when there is no live session to reuse
+            setup = ThreadPoolExecutor(max_workers=3)
+            connection_future = setup.submit(
+                connect_and_submit_ddl,
+                lambda: open_snowflake_connection(
+                    snowflake_secret_id, snowflake_account, snowflake_schema, snowflake_warehouse, snowflake_database
+                ),
+                bucket, create_table_query_key, snowflake_database, snowflake_schema, snowflake_table, run_id
+            )
+            schema_future = setup.submit(fetch_schema_from_s3, bucket, schema_key)
+            # Content already committed to today's partition is not parsed or loaded again
+            hashes_future = setup.submit(lambda: {record: content_hash(*record, etags[record]) for record in records})
+            duplicate_future = setup.submit(
+                check_duplicate_event, connection_future, hashes_future,
+                snowflake_database, snowflake_schema, snowflake_table, partition, audit_table
+            )
+            setup.shutdown(wait=False)
             
-            if validate_df_schema(df, fetch_schema_from_s3(bucket, schema_key)):
-                df = transform_data(df)
-                create_table_in_snowflake(conn, bucket, create_table_query_key, snowflake_database, snowflake_schema, snowflake_table)
-                write_df_to_snowflake(df, snowflake_table, snowflake_database, snowflake_schema, conn)
-                publish_to_sns(os.environ["SNS_ARN"], "Success", f"Data loaded to Snowflake table: {snowflake_table}")
-                
-                return {
-                    "status": "Success"
+            # Files are downloaded and parsed concurrently, a bad file only fails its own record
+            errors, frames, skipped = {}, {}, set()
+            timings = {record: {} for record in records}
+            with ThreadPoolExecutor(max_workers=min(RECORD_WORKERS, len(records))) as executor:
+                futures = {
+                    (event_bucket, event_key): executor.submit(
+                        prepare_record, event_bucket, event_key, schema_future.result, timings[(event_bucket, event_key)],
+                        duplicate_future, plan, partition_values
+                    )
+                    for event_bucket, event_key in records
                 }
-            else:
-                logger.info("Schema validation failed.")
-                raise ValueError("Schema validation failed.")
+                for record, future in futures.items():
+                    try:
+                        df = future.result()
+                        if df is None:
+                            skipped.add(record)
+                        else:
+                            frames[record] = df
+                    except Exception as e:
+                        logger.error(f"Error preparing s3://{record[0]}/{record[1]}: {e}")
+                        errors[record] = e
+            if duplicate_future.result():
+                # Content already committed to the partition, drop what was parsed speculatively
+                skipped.update(frames, errors)
+                frames, errors = {}, {}
+            # A schema that could not be fetched fails the invocation rather than every record separately
+            schema_future.result()
+            conn, wait_for_table = connection_future.result()
+            
+            staged = {record: item for record, item in frames.items() if isinstance(item, StagedParquet)}
+            if staged and len(staged) < len(frames):
+                # Every load replaces the partition, so an event mixing staged and parsed files is loaded as one batch
+                for record, item in staged.items():
+                    try:
+                        frames[record] = item.to_frame(timings[record])
+                    except Exception as e:
+                        logger.error(f"Error preparing s3://{record[0]}/{record[1]}: {e}")
+                        errors[record] = e
+                        del frames[record]
+                staged = {}
+            
+            if staged:
+                try:
+                    load_parquet_via_copy(
+                        list(staged.values()), snowflake_table, snowflake_database, snowflake_schema, conn, wait_for_table,
+                        lambda stage: set_query_tag(conn, query_tag(run_id, stage, [key for _, key in staged]))
+                    )
+                except Exception as e:
+                    discard_snowflake_session(e)
+                    errors.update({record: e for record in staged})
+            elif frames:
+                load_errors = load_partitions(
+                    frames, snowflake_table, snowflake_database, snowflake_schema, conn, wait_for_table, run_id, list(plan.partition)
+                )
+                for error in set(load_errors.values()):
+                    discard_snowflake_session(error)
+                errors.update(load_errors)
+            if frames:
+                # Staged and parsed files alike, so a re-dropped identical file is skipped next time
+                try:
+                    loaded = {record: content for record, content in hashes_future.result().items() if record in frames and record not in errors}
+                    if loaded:
+                        record_committed_load(
+                            conn, snowflake_database, snowflake_schema, snowflake_table, partition,
+                            {key: content for (_, key), content in loaded.items()}, run_id, audit_table
+                        )
+                except Exception as e:
+                    logger.warning(f"Could not record the committed load: {e}")
+            
+            for (event_bucket, event_key), record_timings in timings.items():
+                emit_metric("snowflake_loader.file", run_id=run_id, bucket=event_bucket, key=event_key, **record_timings)
+            try:
+                for statement in fetch_query_metrics(conn, run_id):
+                    emit_metric("snowflake_loader.statement", run_id=run_id, **statement)
+            except Exception as e:
+                logger.warning(f"Could not fetch query metrics: {e}")
+            
+            results = [
+                {"bucket": event_bucket, "key": event_key, "status": "Failed", "error": str(errors[(event_bucket, event_key)])}
+                if (event_bucket, event_key) in errors else
+                {"bucket": event_bucket, "key": event_key, "status": "Skipped", "reason": "Content already loaded"}
+                if (event_bucket, event_key) in skipped else
+                {"bucket": event_bucket, "key": event_key, "status": "Success", "rows": len(frames[(event_bucket, event_key)])}
+                for event_bucket, event_key in futures
+            ]
+            if len(errors) == len(futures):
+                # Nothing was loaded, fail the invocation so it is retried and alerted on
+                raise next(iter(errors.values()))
+            
+            status = "PartialFailure" if errors else "Success"
+            # Only the SQS messages of failed records are redelivered, reloading replaces their partition again
+            failed_messages = list(dict.fromkeys(message_id for record in errors for message_id in messages.get(record, [])))
+            publish_to_sns(
+                os.environ["SNS_ARN"], status,
+                f"Data loaded to Snowflake table: {snowflake_table} ({len(frames) - len(errors.keys() & frames.keys())} of {len(futures)} files,"
+                f" {len(skipped)} already loaded)"
+            )
+            
+            response = {
+                "status": status,
+                "records": results
+            }
+            if messages:
+                response["batchItemFailures"] = [{"itemIdentifier": message_id} for message_id in failed_messages]
+            return response
         except Exception as e:
             logger.error(f"Error in lambda handler: {e}")
+            discard_snowflake_session(e)
             raise
     else:
         logger.error("No event found.")
-        raise ValueError("No event found.")
\ No newline at end of file
+        raise ValueError("No event found.")
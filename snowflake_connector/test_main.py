@@ -1,8 +1,13 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common", "python"))
 import json
+import threading
 import unittest
 from unittest import TestCase, mock
 from unittest.mock import patch, MagicMock
-from main import get_secret, get_private_key, connect_to_snowflake, create_dataframe_from_s3, fetch_schema_from_s3, validate_df_schema, publish_to_sns, connect_to_snowflake, lambda_handler, write_df_to_snowflake, lambda_handler
+import main
+from main import read_excel_header, validate_header, resolve_excel_engine, create_table_in_snowflake, load_df_via_staging, CredentialCache, open_snowflake_connection, get_snowflake_connection, get_secret, get_private_key, connect_to_snowflake, create_dataframe_from_s3, fetch_schema_from_s3, validate_df_schema, publish_to_sns, connect_to_snowflake, lambda_handler, write_df_to_snowflake, lambda_handler
 import pandas as pd
 from io import BytesIO
 
@@ -10,6 +15,13 @@ class TestLambdaFunctions(unittest.TestCase):
         
     def setUp(self):
         super().setUp()
+        main._CONNECTION = None
+        main._CREDENTIALS.invalidate()
+        main._DDL_CACHE.clear()
+        main._VERIFIED_TABLES.clear()
+        main._COMMITTED_LOADS.clear()
+        main._AUDIT_TABLES.clear()
+        main._TRANSFORM_PLANS.clear()
         # Mock connection setup for Snowflake
         self.mock_conn = mock.Mock()
         self.mock_conn.cursor.return_value.execute = mock.Mock()
@@ -102,6 +114,207 @@ class TestLambdaFunctions(unittest.TestCase):
             self.assertFalse(df.empty)
             mock_read_excel.assert_called_once()
 
+    @mock.patch('main.boto3.client')
+    def test_create_dataframe_from_s3_applies_schema(self, mock_boto3_client):
+        mock_body = mock.Mock()
+        mock_body.read.return_value = b'xlsx-bytes'
+        mock_boto3_client.return_value.get_object.return_value = {'Body': mock_body}
+        schema = {"column1": "object", "column2": "int64", "column3": "datetime64[ns]"}
+        with mock.patch('main.pd.read_excel', return_value=pd.DataFrame({'column1': ['value1']})) as mock_read_excel:
+            create_dataframe_from_s3('bucket-name', 'file-path.xlsx', schema, engine='openpyxl')
+
+            kwargs = mock_read_excel.call_args[1]
+            self.assertEqual(kwargs['engine'], 'openpyxl')
+            self.assertEqual(kwargs['sheet_name'], 0)
+            self.assertEqual(kwargs['usecols'], ["column1", "column2", "column3"])
+            self.assertEqual(kwargs['dtype'], {"column1": "object", "column2": "int64"})
+
+    def test_read_excel_header(self):
+        for engine in ('openpyxl', 'xlsxwriter'):
+            output = BytesIO()
+            pd.DataFrame({'Segment': ['a'], 'Value ($)': [1.5]}).to_excel(output, index=False, engine=engine)
+            self.assertEqual(read_excel_header(output.getvalue()), ['Segment', 'Value ($)'])
+
+    def test_read_excel_header_skips_styled_empty_cells(self):
+        from openpyxl import Workbook
+        from openpyxl.styles import Font
+        workbook = Workbook()
+        sheet = workbook.active
+        sheet.append(['Segment', None, 'Value ($)'])
+        sheet.append(['a', 1, 1.5])
+        sheet["D1"].font = Font(bold=True)
+        output = BytesIO()
+        workbook.save(output)
+
+        header = read_excel_header(output.getvalue())
+
+        self.assertEqual(header, ['Segment', 'Unnamed: 1', 'Value ($)'])
+        self.assertEqual(header, list(pd.read_excel(BytesIO(output.getvalue())).columns))
+
+    def test_compact_dtypes(self):
+        df = pd.DataFrame({
+            'Segment': ['Segment 1', 'Segment 2'] * 500,
+            'Id': [f'ID{i}' for i in range(1000)],
+            'Count': range(1000),
+            'Missing': pd.array([1, None] * 500, dtype='Int64'),
+            'Value': [1.5] * 1000,
+        })
+        schema = {'Segment': 'object', 'Id': 'object', 'Count': 'int64', 'Missing': 'Int64', 'Value': 'float64'}
+        original = df.copy()
+
+        before, after = main.compact_dtypes(df, schema)
+
+        self.assertLess(after, before)
+        self.assertEqual(df['Segment'].dtype.name, 'category')
+        self.assertNotEqual(df['Id'].dtype.name, 'category')
+        self.assertEqual(df['Count'].dtype.name, 'int16')
+        self.assertEqual(df['Missing'].dtype.name, 'Int8')
+        self.assertEqual(df['Value'].dtype.name, 'float64')
+        pd.testing.assert_frame_equal(df.astype(original.dtypes.to_dict()), original)
+
+    def test_detect_input_format(self):
+        self.assertEqual(main.detect_input_format('in/2024/file.parquet'), 'parquet')
+        self.assertEqual(main.detect_input_format('in/file.CSV'), 'csv')
+        self.assertEqual(main.detect_input_format('in/file.xlsx'), 'excel')
+        self.assertEqual(main.detect_input_format('in/file', b'PAR1\x15'), 'parquet')
+        self.assertEqual(main.detect_input_format('in/file', b'PK\x03\x04'), 'excel')
+
+    def _parquet_and_csv(self, source):
+        import gzip
+        parquet = BytesIO()
+        source.to_parquet(parquet)
+        csv = source.to_csv(index=False).encode('utf-8')
+        return ((parquet.getvalue(), 'file.parquet'), (csv, 'file.csv'), (gzip.compress(csv), 'file.csv.gz'))
+
+    def test_read_input_bytes_parquet_and_csv(self):
+        schema = {'Segment': 'object', 'Count': 'int64'}
+
+        for content, key in self._parquet_and_csv(pd.DataFrame({'Segment': ['a', 'b'], 'Count': [1, 2]}, index=[5, 6])):
+            df = main.read_input_bytes(content, key, schema)
+            self.assertEqual(list(df.columns), ['Segment', 'Count'])
+            self.assertEqual(df['Count'].tolist(), [1, 2])
+            self.assertEqual(df['Count'].dtype.name, 'int64')
+
+    def test_read_input_bytes_rejects_new_and_reordered_columns(self):
+        schema = {'Segment': 'object', 'Count': 'int64'}
+        extra = pd.DataFrame({'Segment': ['a'], 'Count': [1], 'Extra': [0.5]})
+        reordered = pd.DataFrame({'Count': [1], 'Segment': ['a']})
+
+        for content, key in self._parquet_and_csv(extra):
+            with self.assertRaisesRegex(ValueError, 'New columns'):
+                main.read_input_bytes(content, key, schema)
+        for content, key in self._parquet_and_csv(reordered):
+            with self.assertRaisesRegex(ValueError, 'Column order mismatch'):
+                main.read_input_bytes(content, key, schema)
+
+    def test_staged_parquet_only_for_matching_files(self):
+        schema = {'Segment Name': 'object', 'Value ($)': 'float64', 'Count': 'int64'}
+        matching, other = BytesIO(), BytesIO()
+        pd.DataFrame({'Segment Name': ['a'], 'Value ($)': [1.5], 'Count': [1]}).to_parquet(matching, index=False)
+        pd.DataFrame({'Count': [1], 'Segment Name': ['a'], 'Value ($)': [1.5]}).to_parquet(other, index=False)
+
+        self.assertIsNone(main.StagedParquet.from_content('bucket', 'b.parquet', other.getvalue(), schema))
+        staged = main.StagedParquet.from_content(
+            'bucket', 'in/a.parquet', matching.getvalue(), schema, partition_values={'YYYY': 2024, 'MM': 1, 'DD': 2}
+        )
+        self.assertEqual(len(staged), 1)
+        self.assertEqual(staged.target_columns(), ['SEGMENT_NAME', 'VALUE', 'COUNT', 'YYYY', 'MM', 'DD'])
+        self.assertEqual(
+            staged.select_sql('DB.SC.INPUT_STAGE', 'DB.SC.PARQUET'),
+            """select $1:"Segment Name"::string, $1:"Value ($)"::float, $1:"Count"::number, 2024, 1, 2"""
+            """ from '@DB.SC.INPUT_STAGE/in/a.parquet' (file_format => 'DB.SC.PARQUET')"""
+            """ where not contains(coalesce($1:"Segment Name"::string, ''), 'Total')"""
+        )
+
+    @mock.patch.dict('os.environ', {'SNOWFLAKE_EXTERNAL_STAGE': 'DB.SC.INPUT_STAGE', 'SNOWFLAKE_PARQUET_FILE_FORMAT': 'DB.SC.PARQUET'})
+    def test_load_parquet_via_copy_replaces_partition(self):
+        staged = main.StagedParquet(
+            'bucket', 'in/a.parquet', b'', {'Segment Name': 'object', 'Value ($)': 'float64'}, 1,
+            partition_values={'YYYY': 2024, 'MM': 1, 'DD': 2}
+        )
+
+        main.load_parquet_via_copy([staged, staged], self.table, self.database, self.schema, self.mock_conn)
+
+        statements = [call_args[0] for call_args in self.mock_conn.cursor.return_value.execute.call_args_list]
+        self.assertEqual(statements[0][0], 'begin')
+        self.assertEqual(statements[1][0], 'delete from test_database.test_schema.test_table where YYYY=2024 and MM=1 and DD=2')
+        self.assertTrue(statements[2][0].startswith(
+            'insert into test_database.test_schema.test_table ("SEGMENT_NAME", "VALUE", "YYYY", "MM", "DD") select'
+        ))
+        self.assertEqual(statements[2][0].count(' union all '), 1)
+        self.assertEqual(statements[3][0], 'commit')
+
+    def test_transform_data_default_plan(self):
+        df = pd.DataFrame({'Segment Name': ['a', 'Total', None, 'b'], 'Share (%)': [0.1, 1.0, 0.2, 0.3], 'Value ($)': [1, 2, 3, 4]})
+        df = df.iloc[1:]
+
+        df = main.transform_data(df, partition_values={'YYYY': 2024, 'MM': 1, 'DD': 2})
+
+        self.assertEqual(list(df.columns), ['SEGMENT_NAME', 'SHARE_PCT', 'VALUE', 'YYYY', 'MM', 'DD'])
+        # Total rows are dropped, empty first cells kept, and the index starts at 0 again
+        self.assertEqual(df['VALUE'].tolist(), [3, 4])
+        self.assertEqual(df['YYYY'][0], 2024)
+
+    def test_transform_plan_from_config(self):
+        plan = main.TransformPlan({
+            "rename": {"columns": {"Region": "AREA"}, "replace": [[" ", "_"]]},
+            "partition": {"LOAD_DATE": "date"},
+            "filters": [{"column": "Region", "op": "not_equals", "value": "All"}, {"column": "Sales Total", "op": "not_null"}]
+        })
+        df = pd.DataFrame({'Region': pd.Categorical(['East', 'All', 'West', None]), 'Sales Total': [1.0, 2.0, None, 4.0]})
+
+        df = plan.apply(df, plan.partition_values(pd.Timestamp('2024-01-02')))
+
+        self.assertEqual(list(df.columns), ['AREA', 'Sales_Total', 'LOAD_DATE'])
+        self.assertEqual(df['Sales_Total'].tolist(), [1.0, 4.0])
+        self.assertEqual(df['LOAD_DATE'].tolist(), ['2024-01-02', '2024-01-02'])
+        self.assertEqual(
+            plan.sql_filter(['Region', 'Sales Total'], lambda col: f'$1:"{col}"'),
+            """($1:"Region" is null or $1:"Region"::string <> 'All') and $1:"Sales Total" is not null"""
+        )
+        with self.assertRaisesRegex(ValueError, 'Unknown filter op'):
+            main.TransformPlan({"filters": [{"column": 0, "op": "like", "value": "x"}]})
+
+    @mock.patch('main.boto3.client')
+    def test_fetch_transform_plan_compiles_once(self, mock_boto3_client):
+        mock_boto3_client.return_value.get_object.return_value = {
+            'Body': BytesIO(json.dumps({"partition": {"YYYY": "year"}}).encode())
+        }
+
+        plan = main.fetch_transform_plan('bucket', 'plans/table.json')
+
+        self.assertIs(main.fetch_transform_plan('bucket', 'plans/table.json'), plan)
+        mock_boto3_client.return_value.get_object.assert_called_once_with(Bucket='bucket', Key='plans/table.json')
+        self.assertEqual(list(plan.partition), ['YYYY'])
+        self.assertEqual(main.fetch_transform_plan().target_name('Value ($)'), 'VALUE')
+
+    def test_validate_header(self):
+        schema = {"column1": "object", "column2": "int64"}
+        self.assertTrue(validate_header(["column1", "column2"], schema))
+        with self.assertRaisesRegex(ValueError, "Missing columns"):
+            validate_header(["column1"], schema)
+        with self.assertRaisesRegex(ValueError, "Column order mismatch"):
+            validate_header(["column2", "column1"], schema)
+
+    @mock.patch('main.boto3.client')
+    def test_create_dataframe_from_s3_rejects_header_before_parse(self, mock_boto3_client):
+        output = BytesIO()
+        pd.DataFrame({'column1': ['a'], 'extra': [1]}).to_excel(output, index=False, engine='openpyxl')
+        mock_boto3_client.return_value.get_object.return_value = {'Body': BytesIO(output.getvalue())}
+        with mock.patch('main.pd.read_excel') as mock_read_excel:
+            with self.assertRaisesRegex(ValueError, "New columns"):
+                create_dataframe_from_s3('bucket-name', 'file-path.xlsx', {"column1": "object"})
+            mock_read_excel.assert_not_called()
+
+    @mock.patch.dict('os.environ', {'EXCEL_ENGINE': 'auto'})
+    @mock.patch('main.importlib.util.find_spec')
+    def test_resolve_excel_engine_falls_back_to_openpyxl(self, mock_find_spec):
+        mock_find_spec.return_value = None
+        self.assertEqual(resolve_excel_engine(), 'openpyxl')
+        mock_find_spec.return_value = object()
+        self.assertEqual(resolve_excel_engine(), 'calamine')
+        self.assertEqual(resolve_excel_engine('openpyxl'), 'openpyxl')
+
     @mock.patch('main.boto3.client')
     def test_create_dataframe_from_s3_failure_invalid_path(self, mock_boto3_client):
         # Setup mock S3 client to simulate an error when retrieving the object
@@ -175,6 +388,227 @@ class TestLambdaFunctions(unittest.TestCase):
         conn = connect_to_snowflake('user', 'account', 'private_key', 'schema', 'warehouse', 'database')
         self.assertIsNotNone(conn)
 
+    def test_get_snowflake_connection_reuses_live_session(self):
+        self.mock_conn.is_closed.return_value = False
+        open_connection = mock.Mock(return_value=self.mock_conn)
+
+        first = get_snowflake_connection(open_connection)
+        second = get_snowflake_connection(open_connection)
+
+        self.assertIs(first, second)
+        open_connection.assert_called_once()
+        self.mock_conn.cursor.return_value.execute.assert_called_with("select 1")
+
+    def test_get_snowflake_connection_reconnects_dead_session(self):
+        stale_conn = mock.Mock()
+        stale_conn.is_closed.return_value = False
+        stale_conn.cursor.return_value.execute.side_effect = Exception("Session expired")
+        main._CONNECTION = stale_conn
+
+        conn = get_snowflake_connection(mock.Mock(return_value=self.mock_conn))
+
+        self.assertIs(conn, self.mock_conn)
+        stale_conn.close.assert_called_once()
+
+    def test_credential_cache_reuses_until_expiry(self):
+        loader = mock.Mock(side_effect=[{"user": "u1"}, {"user": "u2"}])
+        cache = CredentialCache(loader, ttl=60, refresh_margin=0)
+
+        self.assertEqual(cache.get("secret"), {"user": "u1"})
+        self.assertEqual(cache.get("secret"), {"user": "u1"})
+        loader.assert_called_once_with("secret")
+
+        cache.invalidate("secret")
+        self.assertEqual(cache.get("secret"), {"user": "u2"})
+
+    def test_credential_cache_refreshes_in_background(self):
+        loader = mock.Mock(side_effect=[{"user": "u1"}, {"user": "u2"}])
+        cache = CredentialCache(loader, ttl=60, refresh_margin=60)
+
+        cache.get("secret")
+        with mock.patch('main.threading.Thread') as mock_thread:
+            self.assertEqual(cache.get("secret"), {"user": "u1"})
+            mock_thread.assert_called_once()
+            mock_thread.call_args[1]['target'](*mock_thread.call_args[1]['args'])
+
+        self.assertEqual(cache.get("secret")["user"], "u2")
+
+    @mock.patch('main.connect_to_snowflake')
+    @mock.patch('main.load_snowflake_credentials')
+    def test_open_snowflake_connection_reloads_rotated_key(self, mock_load_credentials, mock_connect_to_snowflake):
+        auth_error = Exception("JWT token is invalid")
+        mock_load_credentials.side_effect = [{"user": "u", "private_key": b"old"}, {"user": "u", "private_key": b"new"}]
+        mock_connect_to_snowflake.side_effect = [auth_error, self.mock_conn]
+
+        conn = open_snowflake_connection('secret', 'account', 'schema', 'warehouse', 'database')
+
+        self.assertIs(conn, self.mock_conn)
+        self.assertEqual(mock_connect_to_snowflake.call_args[0][2], b"new")
+
+    @mock.patch('main.boto3.client')
+    def test_create_table_in_snowflake_runs_ddl_for_missing_table(self, mock_boto3_client):
+        mock_body = mock.Mock()
+        mock_body.read.return_value = b'create table if not exists @database.@schema.@table (a int)'
+        mock_boto3_client.return_value.get_object.return_value = {'Body': mock_body}
+        self.mock_conn.cursor.return_value.fetchone = mock.Mock(return_value=None)
+
+        create_table_in_snowflake(self.mock_conn, 'bucket', 'ddl.sql', self.database, self.schema, self.table)
+        create_table_in_snowflake(self.mock_conn, 'bucket', 'ddl.sql', self.database, self.schema, self.table)
+
+        statements = [call_args[0][0] for call_args in self.mock_conn.cursor.return_value.execute.call_args_list]
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(statements[1], 'create table if not exists test_database.test_schema.test_table (a int)')
+        self.assertTrue(statements[2].startswith("comment on table test_database.test_schema.test_table is 'ddl_sha256="))
+        mock_boto3_client.return_value.get_object.assert_called_once()
+
+    @mock.patch('main.boto3.client')
+    def test_create_table_in_snowflake_skips_matching_table(self, mock_boto3_client):
+        ddl = b'create table if not exists @database.@schema.@table (a int)'
+        mock_body = mock.Mock()
+        mock_body.read.return_value = ddl
+        mock_boto3_client.return_value.get_object.return_value = {'Body': mock_body}
+        rendered = 'create table if not exists test_database.test_schema.test_table (a int)'
+        fingerprint = main.hashlib.sha256(rendered.encode('utf-8')).hexdigest()
+        self.mock_conn.cursor.return_value.fetchone = mock.Mock(return_value=(f'ddl_sha256={fingerprint}',))
+
+        create_table_in_snowflake(self.mock_conn, 'bucket', 'ddl.sql', self.database, self.schema, self.table)
+
+        statements = [call_args[0][0] for call_args in self.mock_conn.cursor.return_value.execute.call_args_list]
+        self.assertEqual(len(statements), 1)
+        self.assertIn('information_schema.tables', statements[0])
+
+    @mock.patch('main.time.sleep')
+    @mock.patch('main.boto3.client')
+    def test_create_table_in_snowflake_submits_ddl_asynchronously(self, mock_boto3_client, mock_sleep):
+        mock_body = mock.Mock()
+        mock_body.read.return_value = b'create table if not exists @database.@schema.@table (a int)'
+        mock_boto3_client.return_value.get_object.return_value = {'Body': mock_body}
+        cursor = self.mock_conn.cursor.return_value
+        cursor.fetchone = mock.Mock(return_value=None)
+        cursor.sfqid = 'ddl-query-id'
+        self.mock_conn.is_still_running.side_effect = [True, False]
+
+        wait_for_table = create_table_in_snowflake(self.mock_conn, 'bucket', 'ddl.sql', self.database, self.schema, self.table, asynchronous=True)
+
+        cursor.execute_async.assert_called_once_with('create table if not exists test_database.test_schema.test_table (a int)')
+        self.assertEqual(cursor.execute.call_count, 1)
+        wait_for_table()
+        wait_for_table()
+        self.mock_conn.get_query_status_throw_if_error.assert_called_with('ddl-query-id')
+        self.assertEqual(self.mock_conn.is_still_running.call_count, 2)
+        statements = [call_args[0][0] for call_args in cursor.execute.call_args_list]
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(statements[1].startswith("comment on table test_database.test_schema.test_table is 'ddl_sha256="))
+
+    @mock.patch('main.write_pandas')
+    def test_load_df_via_staging_waits_for_table_after_upload(self, mock_write_pandas):
+        calls = []
+        mock_write_pandas.side_effect = lambda **kwargs: calls.append('upload') or (True, 1, 1, [])
+        self.mock_conn.cursor.return_value.execute.side_effect = lambda statement: calls.append(statement.split()[0])
+
+        load_df_via_staging(pd.DataFrame(self.mock_data), self.table, self.database, self.schema, self.mock_conn,
+                            wait_for_table=lambda: calls.append('ddl'))
+
+        self.assertEqual(calls, ['upload', 'ddl', 'begin', 'delete', 'insert', 'commit'])
+
+    def test_write_df_to_snowflake_tags_each_stage(self):
+        tags = []
+        with mock.patch.dict('os.environ', {'LOAD_MODE': 'direct'}), \
+                mock.patch('main.write_pandas', side_effect=lambda **kwargs: tags.append('write_pandas') or (True, 1, 1, [])):
+            write_df_to_snowflake(pd.DataFrame(self.mock_data), self.table, self.database, self.schema, self.mock_conn,
+                                  tag_stage=lambda stage: tags.append(main.query_tag('run-1', stage, ['a.xlsx'])))
+
+        self.assertEqual(tags, ['snowflake_connector:run-1:delete:a.xlsx', 'snowflake_connector:run-1:copy:a.xlsx', 'write_pandas'])
+
+    @mock.patch('main.time.sleep')
+    def test_wait_for_queries_times_out(self, mock_sleep):
+        self.mock_conn.is_still_running.return_value = True
+        with mock.patch('main.time.time', side_effect=[0, 1, 2, 11]):
+            with self.assertRaisesRegex(TimeoutError, 'query-1'):
+                main.wait_for_queries(self.mock_conn, ['query-1'], timeout=10)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+    def test_is_duplicate_load_uses_local_cache(self):
+        partition = (('YYYY', 2024), ('MM', 1), ('DD', 2))
+        self.assertFalse(main.is_duplicate_load(self.mock_conn, self.database, self.schema, self.table, partition, ['a']))
+        main.record_committed_load(self.mock_conn, self.database, self.schema, self.table, partition, {'a.xlsx': 'a', 'b.xlsx': 'b'}, 'run-1')
+        self.assertTrue(main.is_duplicate_load(self.mock_conn, self.database, self.schema, self.table, partition, ['a']))
+        self.assertFalse(main.is_duplicate_load(self.mock_conn, self.database, self.schema, self.table, partition, ['a', 'c']))
+        self.mock_conn.cursor.return_value.execute.assert_not_called()
+
+    def test_is_duplicate_load_reads_control_table(self):
+        cursor = self.mock_conn.cursor.return_value
+        cursor.fetchall = mock.Mock(return_value=[('a',), ('b',)])
+
+        partition = (('YYYY', 2024), ('MM', 1), ('DD', 2))
+        self.assertTrue(main.is_duplicate_load(self.mock_conn, self.database, self.schema, self.table, partition, ['b'], 'LOAD_AUDIT'))
+
+        statements = [call_args[0] for call_args in cursor.execute.call_args_list]
+        self.assertIn('create table if not exists test_database.test_schema.LOAD_AUDIT', statements[0][0])
+        self.assertEqual(statements[1][1], ('test_table', 'YYYY=2024/MM=1/DD=2') * 2)
+        main.record_committed_load(self.mock_conn, self.database, self.schema, self.table, partition, {'c.xlsx': 'c'}, 'run-2', 'LOAD_AUDIT')
+        self.assertEqual(cursor.executemany.call_args[0][1], [('test_table', 'YYYY=2024/MM=1/DD=2', 'c', 'c.xlsx', 'run-2')])
+
+    @mock.patch('main.download_from_s3')
+    def test_prepare_record_skips_duplicates(self, mock_download_from_s3):
+        duplicate = mock.Mock()
+        duplicate.done.return_value = True
+        duplicate.result.return_value = True
+
+        self.assertIsNone(main.prepare_record('bucket', 'key.xlsx', mock.Mock(), {}, duplicate))
+        mock_download_from_s3.assert_not_called()
+
+    def test_fetch_query_metrics_filters_on_run(self):
+        cursor = self.mock_conn.cursor.return_value
+        cursor.fetchall = mock.Mock(return_value=[('01a', 'snowflake_connector:run-1:copy:a.xlsx', 'COPY', 'SUCCESS', 850, 0, 1, 2048)])
+
+        metrics = main.fetch_query_metrics(self.mock_conn, 'run-1')
+
+        self.assertEqual(cursor.execute.call_args[0][1], ('snowflake_connector:run-1:',))
+        self.assertEqual(metrics, [{
+            "query_id": "01a", "query_tag": "snowflake_connector:run-1:copy:a.xlsx", "query_type": "COPY", "status": "SUCCESS",
+            "elapsed_ms": 850, "queued_provisioning_ms": 0, "rows": 1, "bytes_scanned": 2048
+        }])
+
+    @mock.patch('main.write_pandas')
+    def test_load_df_via_staging_swaps_partition_in_one_transaction(self, mock_write_pandas):
+        mock_write_pandas.return_value = (True, 1, 1, [])
+        df = pd.DataFrame(self.mock_data)
+
+        load_df_via_staging(df, self.table, self.database, self.schema, self.mock_conn)
+
+        self.assertEqual(mock_write_pandas.call_args[1]['table_name'], 'test_table_STAGE')
+        self.assertEqual(mock_write_pandas.call_args[1]['table_type'], 'temporary')
+        self.assertTrue(mock_write_pandas.call_args[1]['overwrite'])
+        statements = [call_args[0][0] for call_args in self.mock_conn.cursor.return_value.execute.call_args_list]
+        self.assertEqual(statements[0], 'begin')
+        self.assertTrue(statements[1].startswith('delete from test_database.test_schema.test_table using'))
+        self.assertTrue(statements[2].startswith('insert into test_database.test_schema.test_table ("YYYY", "MM", "DD"'))
+        self.assertEqual(statements[3], 'commit')
+
+    def test_write_pandas_options_scale_with_frame(self):
+        small = main.write_pandas_options(pd.DataFrame(self.mock_data))
+        self.assertEqual(small, {"chunk_size": small["chunk_size"], "parallel": 1, "compression": "gzip", "row_group_size": small["row_group_size"]})
+        with mock.patch('main.WRITE_CHUNK_TARGET_BYTES', 1000):
+            large = main.write_pandas_options(pd.DataFrame({'value': range(10000)}))
+        self.assertEqual(large["chunk_size"], 125)
+        self.assertEqual(large["parallel"], main.WRITE_MAX_PARALLEL)
+        self.assertEqual(large["compression"], "snappy")
+        self.assertEqual(large["row_group_size"], 125)
+        with mock.patch.dict('os.environ', {'WRITE_CHUNK_ROWS': '500', 'WRITE_COMPRESSION': 'gzip'}):
+            pinned = main.write_pandas_options(pd.DataFrame({'value': range(10000)}))
+        self.assertEqual((pinned["chunk_size"], pinned["parallel"], pinned["compression"]), (500, 16, "gzip"))
+
+    @mock.patch('main.write_pandas')
+    def test_load_df_via_staging_rolls_back_on_failure(self, mock_write_pandas):
+        mock_write_pandas.return_value = (True, 1, 1, [])
+        self.mock_conn.cursor.return_value.execute.side_effect = [None, Exception("Delete failed"), None]
+
+        with self.assertRaises(Exception):
+            load_df_via_staging(pd.DataFrame(self.mock_data), self.table, self.database, self.schema, self.mock_conn)
+
+        self.mock_conn.cursor.return_value.execute.assert_called_with('rollback')
+
     @mock.patch('main.write_pandas')
     @mock.patch('main.logger')
     def test_write_df_to_snowflake_success(self, mock_logger, mock_write_pandas):
@@ -194,7 +628,8 @@ class TestLambdaFunctions(unittest.TestCase):
             df=self.df, 
             table_name=self.table, 
             schema=self.schema, 
-            database=self.database
+            database=self.database,
+            **main.write_pandas_options(self.df)
         )
         
         # Verify logging of successful write
@@ -231,28 +666,273 @@ class TestLambdaFunctions(unittest.TestCase):
     @mock.patch('main.transform_data')
     @mock.patch('main.validate_df_schema')
     @mock.patch('main.fetch_schema_from_s3')
-    @mock.patch('main.create_dataframe_from_s3')
+    @mock.patch('main.read_excel_bytes')
+    @mock.patch('main.download_from_s3')
     @mock.patch('main.connect_to_snowflake')
     @mock.patch('main.get_private_key')
     @mock.patch('main.get_secret')
-    def test_lambda_handler_success(self, mock_get_secret, mock_get_private_key, mock_connect_to_snowflake, mock_create_dataframe_from_s3,
-                                    mock_fetch_schema_from_s3, mock_validate_df_schema, mock_transform_data, mock_create_table_in_snowflake,
+    def test_lambda_handler_success(self, mock_get_secret, mock_get_private_key, mock_connect_to_snowflake, mock_download_from_s3,
+                                    mock_read_excel_bytes, mock_fetch_schema_from_s3, mock_validate_df_schema, mock_transform_data, mock_create_table_in_snowflake,
                                     mock_write_df_to_snowflake, mock_publish_to_sns):
         # Setup mocks
         mock_get_secret.return_value = {"user": "test_user", "privateKey": "test_private_key"}
         mock_get_private_key.return_value = b"mocked_private_key_bytes"
         mock_connect_to_snowflake.return_value = self.mock_conn
-        mock_create_dataframe_from_s3.return_value = self.mock_data  # Simulate DataFrame with a dictionary
+        mock_read_excel_bytes.return_value = pd.DataFrame(self.mock_data)
         mock_fetch_schema_from_s3.return_value = {"test": "schema"}
         mock_validate_df_schema.return_value = True
-        mock_transform_data.return_value = self.mock_data  # Again, simulate with simple structure
+        mock_transform_data.return_value = pd.DataFrame(self.mock_data)
         # Add more mock configurations as necessary
 
         # Execute lambda_handler
-        result = lambda_handler({'Records': [{'s3': {'bucket': {'name': 'test_bucket'}, 'object': {'key': 'test_key'}}}]}, {})
+        result = lambda_handler({'Records': [{'s3': {'bucket': {'name': 'test_bucket'}, 'object': {'key': 'test_key', 'eTag': 'etag-1'}}}]}, {})
         
         # Validate expected outcomes
-        self.assertEqual(result, {"status": "Success"})
+        self.assertEqual(result, {
+            "status": "Success",
+            "records": [{"bucket": "test_bucket", "key": "test_key", "status": "Success", "rows": 1}]
+        })
+
+    @patch.dict('os.environ', {
+        "SNOWFLAKE_SECRET_ID": "test_secret_id",
+        "BUCKET": "test_bucket",
+        "SCHEMA_KEY": "test_schema_key",
+        "SNOWFLAKE_TABLE": "test_table",
+        "SNOWFLAKE_SCHEMA": "test_schema",
+        "SNOWFLAKE_DATABASE": "test_database",
+        "SNOWFLAKE_WAREHOUSE": "test_warehouse",
+        "SNOWFLAKE_ACCOUNT": "test_account",
+        "CREATE_TABLE_QUERY_KEY": "test_create_table_query",
+        "SNS_ARN": "test_sns_arn"
+    })
+    @mock.patch('main.publish_to_sns')
+    @mock.patch('main.write_df_to_snowflake')
+    @mock.patch('main.create_table_in_snowflake')
+    @mock.patch('main.fetch_schema_from_s3')
+    @mock.patch('main.prepare_record')
+    @mock.patch('main.get_snowflake_connection')
+    def test_lambda_handler_processes_every_record(self, mock_get_connection, mock_prepare_record, mock_fetch_schema_from_s3,
+                                                   mock_create_table_in_snowflake, mock_write_df_to_snowflake, mock_publish_to_sns):
+        mock_get_connection.return_value = self.mock_conn
+        frames = {'a.xlsx': pd.DataFrame(self.mock_data), 'b c.xlsx': pd.DataFrame(self.mock_data)}
+        def prepare(event_bucket, event_key, get_schema, timings, duplicate, plan, partition_values):
+            if event_key not in frames:
+                raise ValueError("Missing columns: ['column2']")
+            return frames[event_key]
+        mock_prepare_record.side_effect = prepare
+        records = [{'s3': {'bucket': {'name': 'test_bucket'}, 'object': {'key': key, 'eTag': f'etag-{key}'}}} for key in ('a.xlsx', 'bad.xlsx')]
+        # A notification replayed through SQS, with an URL-encoded key
+        records.append({'messageId': 'msg-1', 'body': json.dumps({'Records': [{'s3': {'bucket': {'name': 'test_bucket'}, 'object': {'key': 'b+c.xlsx', 'eTag': 'etag-b'}}}]})})
+
+        result = lambda_handler({'Records': records}, {})
+
+        self.assertEqual(result["status"], "PartialFailure")
+        self.assertEqual([record["status"] for record in result["records"]], ["Success", "Failed", "Success"])
+        self.assertEqual(result["records"][2]["key"], "b c.xlsx")
+        mock_get_connection.assert_called_once()
+        mock_create_table_in_snowflake.assert_called_once()
+        # Both good files share a date partition, so they are loaded as one batch
+        mock_write_df_to_snowflake.assert_called_once()
+        self.assertEqual(len(mock_write_df_to_snowflake.call_args[0][0]), 2)
+        self.assertEqual(mock_publish_to_sns.call_args[0][1], "PartialFailure")
+
+    @patch.dict('os.environ', {
+        "SNOWFLAKE_SECRET_ID": "test_secret_id",
+        "BUCKET": "test_bucket",
+        "SCHEMA_KEY": "test_schema_key",
+        "SNOWFLAKE_TABLE": "test_table",
+        "SNOWFLAKE_SCHEMA": "test_schema",
+        "SNOWFLAKE_DATABASE": "test_database",
+        "SNOWFLAKE_WAREHOUSE": "test_warehouse",
+        "SNOWFLAKE_ACCOUNT": "test_account",
+        "CREATE_TABLE_QUERY_KEY": "test_create_table_query",
+        "SNS_ARN": "test_sns_arn"
+    })
+    @mock.patch('main.publish_to_sns')
+    @mock.patch('main.write_df_to_snowflake')
+    @mock.patch('main.create_table_in_snowflake')
+    @mock.patch('main.fetch_schema_from_s3')
+    @mock.patch('main.prepare_record')
+    @mock.patch('main.get_snowflake_connection')
+    def test_lambda_handler_reports_failed_sqs_messages(self, mock_get_connection, mock_prepare_record, mock_fetch_schema_from_s3,
+                                                        mock_create_table_in_snowflake, mock_write_df_to_snowflake, mock_publish_to_sns):
+        mock_get_connection.return_value = self.mock_conn
+        def prepare(event_bucket, event_key, get_schema, timings, duplicate, plan, partition_values):
+            if event_key == 'bad.xlsx':
+                raise ValueError("Missing columns: ['column2']")
+            return pd.DataFrame(self.mock_data)
+        mock_prepare_record.side_effect = prepare
+        records = [
+            {'messageId': f'msg-{key}', 'body': json.dumps({'Records': [{'s3': {'bucket': {'name': 'test_bucket'}, 'object': {'key': key, 'eTag': key}}}]})}
+            for key in ('a.xlsx', 'bad.xlsx')
+        ]
+
+        result = lambda_handler({'Records': records}, {})
+
+        self.assertEqual(result["status"], "PartialFailure")
+        self.assertEqual(result["batchItemFailures"], [{"itemIdentifier": "msg-bad.xlsx"}])
+        with self.assertRaisesRegex(ValueError, 'no S3 object records'):
+            lambda_handler({'Records': []}, {})
+
+    @patch.dict('os.environ', {
+        "SNOWFLAKE_SECRET_ID": "test_secret_id",
+        "BUCKET": "test_bucket",
+        "SCHEMA_KEY": "test_schema_key",
+        "SNOWFLAKE_TABLE": "test_table",
+        "SNOWFLAKE_SCHEMA": "test_schema",
+        "SNOWFLAKE_DATABASE": "test_database",
+        "SNOWFLAKE_WAREHOUSE": "test_warehouse",
+        "SNOWFLAKE_ACCOUNT": "test_account",
+        "CREATE_TABLE_QUERY_KEY": "test_create_table_query",
+        "SNS_ARN": "test_sns_arn"
+    })
+    @mock.patch('main.publish_to_sns')
+    @mock.patch('main.write_df_to_snowflake')
+    @mock.patch('main.create_table_in_snowflake')
+    @mock.patch('main.transform_data')
+    @mock.patch('main.validate_df_schema')
+    @mock.patch('main.read_excel_bytes')
+    @mock.patch('main.fetch_schema_from_s3')
+    @mock.patch('main.download_from_s3')
+    @mock.patch('main.get_snowflake_connection')
+    def test_lambda_handler_connects_while_downloading(self, mock_get_connection, mock_download_from_s3, mock_fetch_schema_from_s3,
+                                                       mock_read_excel_bytes, mock_validate_df_schema, mock_transform_data,
+                                                       mock_create_table_in_snowflake, mock_write_df_to_snowflake, mock_publish_to_sns):
+        downloading = threading.Event()
+        connected = threading.Event()
+        def connect(open_connection):
+            # Only completes if the download is in flight at the same time
+            self.assertTrue(downloading.wait(5))
+            connected.set()
+            return self.mock_conn
+        def download(event_bucket, event_key):
+            downloading.set()
+            self.assertTrue(connected.wait(5))
+            return b'xlsx-bytes'
+        mock_get_connection.side_effect = connect
+        mock_download_from_s3.side_effect = download
+        mock_fetch_schema_from_s3.return_value = {"column1": "object"}
+        mock_transform_data.return_value = pd.DataFrame(self.mock_data)
+
+        result = lambda_handler({'Records': [{'s3': {'bucket': {'name': 'test_bucket'}, 'object': {'key': 'test_key', 'eTag': 'etag-1'}}}]}, {})
+
+        self.assertEqual(result["status"], "Success")
+        mock_read_excel_bytes.assert_called_once_with(b'xlsx-bytes', {"column1": "object"})
+        mock_create_table_in_snowflake.assert_called_once()
+        self.assertIs(mock_write_df_to_snowflake.call_args[0][4], self.mock_conn)
+
+    @patch.dict('os.environ', {
+        "SNOWFLAKE_SECRET_ID": "test_secret_id",
+        "BUCKET": "test_bucket",
+        "SCHEMA_KEY": "test_schema_key",
+        "SNOWFLAKE_TABLE": "test_table",
+        "SNOWFLAKE_SCHEMA": "test_schema",
+        "SNOWFLAKE_DATABASE": "test_database",
+        "SNOWFLAKE_WAREHOUSE": "test_warehouse",
+        "SNOWFLAKE_ACCOUNT": "test_account",
+        "CREATE_TABLE_QUERY_KEY": "test_create_table_query",
+        "SNS_ARN": "test_sns_arn"
+    })
+    @mock.patch('main.publish_to_sns')
+    @mock.patch('main.write_df_to_snowflake')
+    @mock.patch('main.create_table_in_snowflake')
+    @mock.patch('main.transform_data')
+    @mock.patch('main.validate_df_schema')
+    @mock.patch('main.read_excel_bytes')
+    @mock.patch('main.fetch_schema_from_s3')
+    @mock.patch('main.download_from_s3')
+    @mock.patch('main.get_snowflake_connection')
+    def test_lambda_handler_parses_while_connecting(self, mock_get_connection, mock_download_from_s3, mock_fetch_schema_from_s3,
+                                                    mock_read_excel_bytes, mock_validate_df_schema, mock_transform_data,
+                                                    mock_create_table_in_snowflake, mock_write_df_to_snowflake, mock_publish_to_sns):
+        parsed = threading.Event()
+        def connect(open_connection):
+            # Only completes if the file is parsed before the connection is up
+            self.assertTrue(parsed.wait(5))
+            return self.mock_conn
+        def parse(content, schema):
+            parsed.set()
+            return pd.DataFrame(self.mock_data)
+        mock_get_connection.side_effect = connect
+        mock_download_from_s3.return_value = b'xlsx-bytes'
+        mock_read_excel_bytes.side_effect = parse
+        mock_fetch_schema_from_s3.return_value = {"column1": "object"}
+        mock_transform_data.return_value = pd.DataFrame(self.mock_data)
+
+        result = lambda_handler({'Records': [{'s3': {'bucket': {'name': 'test_bucket'}, 'object': {'key': 'test_key', 'eTag': 'etag-1'}}}]}, {})
+
+        self.assertEqual(result["status"], "Success")
+        mock_write_df_to_snowflake.assert_called_once()
+
+    @patch.dict('os.environ', {
+        "SNOWFLAKE_SECRET_ID": "test_secret_id",
+        "BUCKET": "test_bucket",
+        "SCHEMA_KEY": "test_schema_key",
+        "SNOWFLAKE_TABLE": "test_table",
+        "SNOWFLAKE_SCHEMA": "test_schema",
+        "SNOWFLAKE_DATABASE": "test_database",
+        "SNOWFLAKE_WAREHOUSE": "test_warehouse",
+        "SNOWFLAKE_ACCOUNT": "test_account",
+        "CREATE_TABLE_QUERY_KEY": "test_create_table_query",
+        "SNS_ARN": "test_sns_arn"
+    })
+    @mock.patch('main.publish_to_sns')
+    @mock.patch('main.write_df_to_snowflake')
+    @mock.patch('main.create_table_in_snowflake')
+    @mock.patch('main.transform_data')
+    @mock.patch('main.validate_df_schema')
+    @mock.patch('main.read_excel_bytes')
+    @mock.patch('main.fetch_schema_from_s3')
+    @mock.patch('main.download_from_s3')
+    @mock.patch('main.get_snowflake_connection')
+    def test_lambda_handler_drops_speculative_parse_of_duplicate(self, mock_get_connection, mock_download_from_s3, mock_fetch_schema_from_s3,
+                                                                 mock_read_excel_bytes, mock_validate_df_schema, mock_transform_data,
+                                                                 mock_create_table_in_snowflake, mock_write_df_to_snowflake, mock_publish_to_sns):
+        partition = tuple(main.fetch_transform_plan().partition_values().items())
+        main.record_committed_load(self.mock_conn, 'test_database', 'test_schema', 'test_table', partition, {'test_key': 'etag-1'}, 'run-0')
+        mock_get_connection.return_value = self.mock_conn
+        mock_download_from_s3.return_value = b'xlsx-bytes'
+        mock_fetch_schema_from_s3.return_value = {"column1": "object"}
+        mock_transform_data.return_value = pd.DataFrame(self.mock_data)
+
+        result = lambda_handler({'Records': [{'s3': {'bucket': {'name': 'test_bucket'}, 'object': {'key': 'test_key', 'eTag': '"etag-1"'}}}]}, {})
+
+        self.assertEqual(result["records"][0]["status"], "Skipped")
+        mock_write_df_to_snowflake.assert_not_called()
+
+    @patch.dict('os.environ', {
+        "SNOWFLAKE_SECRET_ID": "test_secret_id",
+        "BUCKET": "test_bucket",
+        "SCHEMA_KEY": "test_schema_key",
+        "SNOWFLAKE_TABLE": "test_table",
+        "SNOWFLAKE_SCHEMA": "test_schema",
+        "SNOWFLAKE_DATABASE": "test_database",
+        "SNOWFLAKE_WAREHOUSE": "test_warehouse",
+        "SNOWFLAKE_ACCOUNT": "test_account",
+        "CREATE_TABLE_QUERY_KEY": "test_create_table_query",
+        "SNS_ARN": "test_sns_arn"
+    })
+    @mock.patch('main.publish_to_sns')
+    @mock.patch('main.load_parquet_via_copy')
+    @mock.patch('main.create_table_in_snowflake')
+    @mock.patch('main.fetch_schema_from_s3')
+    @mock.patch('main.download_from_s3')
+    @mock.patch('main.get_snowflake_connection')
+    def test_lambda_handler_records_staged_parquet_loads(self, mock_get_connection, mock_download_from_s3, mock_fetch_schema_from_s3,
+                                                         mock_create_table_in_snowflake, mock_load_parquet_via_copy, mock_publish_to_sns):
+        content = BytesIO()
+        pd.DataFrame({'Segment Name': ['a'], 'Value ($)': [1.5]}).to_parquet(content, index=False)
+        mock_get_connection.return_value = self.mock_conn
+        mock_download_from_s3.return_value = content.getvalue()
+        mock_fetch_schema_from_s3.return_value = {'Segment Name': 'object', 'Value ($)': 'float64'}
+        event = {'Records': [{'s3': {'bucket': {'name': 'test_bucket'}, 'object': {'key': 'in/a.parquet', 'eTag': 'etag-1'}}}]}
+
+        with mock.patch.dict('os.environ', {'SNOWFLAKE_EXTERNAL_STAGE': 'DB.SC.INPUT_STAGE', 'SNOWFLAKE_PARQUET_FILE_FORMAT': 'DB.SC.PARQUET'}):
+            self.assertEqual(lambda_handler(event, {})["records"][0]["status"], "Success")
+            # The same file dropped again is skipped like a parsed one would be
+            self.assertEqual(lambda_handler(event, {})["records"][0]["status"], "Skipped")
+
+        mock_load_parquet_via_copy.assert_called_once()
 
 if __name__ == '__main__':
     unittest.main()
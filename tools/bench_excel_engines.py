@@ -0,0 +1,74 @@
+"""Benchmarks the Snowflake loader's Excel engines on a representative workbook.
+
+Builds a wide sheet shaped like the daily loader input (a text segment column,
+repeated text, integers and many float columns), then times read_excel with
+each available engine, with and without the schema's dtypes and usecols.
+
+Usage:
+    python tools/bench_excel_engines.py --rows 20000 --columns 60 --repeat 3
+"""
+import io
+import sys
+import time
+import argparse
+import importlib.util
+from typing import Dict, List
+
+import pandas as pd
+import numpy as np
+
+
+def build_workbook(rows: int, columns: int) -> bytes:
+    """Writes a representative workbook and returns its bytes."""
+    rng = np.random.default_rng(0)
+    data = {
+        "Segment": rng.choice([f"Segment {i}" for i in range(40)], rows),
+        "Asset Class": rng.choice(["Corporate", "Treasury", "Agency", "Municipal"], rows),
+        "Count": rng.integers(0, 1000, rows),
+    }
+    for index in range(columns - len(data)):
+        data[f"Value {index} ($)"] = rng.normal(1e6, 2e5, rows).round(2)
+    output = io.BytesIO()
+    pd.DataFrame(data).to_excel(output, index=False, engine="xlsxwriter")
+    return output.getvalue()
+
+
+def available_engines() -> List[str]:
+    return [
+        engine for engine, module in (("calamine", "python_calamine"), ("openpyxl", "openpyxl"))
+        if importlib.util.find_spec(module)
+    ]
+
+
+def time_read(content: bytes, repeat: int, **options) -> float:
+    """Returns the best of repeat read_excel timings in seconds."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pd.read_excel(io.BytesIO(content), sheet_name=0, **options)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(argv: List[str] = None) -> int:
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--rows", type=int, default=20000)
+    arg_parser.add_argument("--columns", type=int, default=60)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args(argv)
+
+    content = build_workbook(args.rows, args.columns)
+    frame = pd.read_excel(io.BytesIO(content), sheet_name=0, nrows=5)
+    schema: Dict[str, str] = {
+        col: ("object" if dtype.name in ("object", "str") else dtype.name) for col, dtype in frame.dtypes.items()
+    }
+    print(f"{args.rows} rows x {args.columns} columns, {len(content) / 1024 / 1024:.1f} MiB")
+    for engine in available_engines():
+        inferred = time_read(content, args.repeat, engine=engine)
+        typed = time_read(content, args.repeat, engine=engine, usecols=list(schema), dtype=schema)
+        print(f"{engine:>10}: {inferred:7.2f}s inferred dtypes, {typed:7.2f}s schema dtypes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
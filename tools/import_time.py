@@ -0,0 +1,100 @@
+"""Reports the cold import time of each Lambda handler and checks it against a budget.
+
+Every handler is imported in a fresh interpreter with ``-X importtime`` so the
+numbers reflect a Lambda cold start rather than a warm test process.
+
+Usage:
+    python tools/import_time.py --budget-ms 400
+    python tools/import_time.py snowflake_connector/main.py --budget-ms 250 --top 5
+"""
+import os
+import sys
+import argparse
+import subprocess
+from typing import List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules the Lambdas get from the common layer, mounted at /opt/python.
+LAYER_PATH = os.path.join(REPO_ROOT, "common", "python")
+
+HANDLERS = [
+    "clear_files_on_alert/clear_files_on_alert.py",
+    "csv_generator/csv_generator.py",
+    "excel_generator/excel_generator.py",
+    "parser/parser.py",
+    "snowflake_connector/main.py",
+    "trigger/trigger.py",
+    "url_generator_lambda/url_generator.py",
+]
+
+
+def parse_importtime(output: str) -> List[Tuple[int, int, int, str]]:
+    """Parses ``-X importtime`` output into (depth, self_us, cumulative_us, module) rows."""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        stripped = name.lstrip(" ")
+        depth = (len(name) - len(stripped) - 1) // 2
+        rows.append((depth, int(fields[0]), int(fields[1]), stripped))
+    return rows
+
+
+def measure_import(handler_path: str) -> dict:
+    """Imports a handler in a clean interpreter and returns its import-time report."""
+    handler_dir, handler_file = os.path.split(os.path.join(REPO_ROOT, handler_path))
+    module = os.path.splitext(handler_file)[0]
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=handler_dir,
+        env={**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, [LAYER_PATH, os.environ.get("PYTHONPATH")]))},
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {handler_path} failed: {result.stderr.strip().splitlines()[-1]}")
+    total_us, children = 0, []
+    pending = []
+    for depth, _, cumulative, name in parse_importtime(result.stderr):
+        if depth == 1:
+            pending.append((name, cumulative / 1000))
+        elif depth == 0:
+            if name == module:
+                total_us, children = cumulative, pending
+            pending = []
+    return {
+        "handler": handler_path,
+        "total_ms": total_us / 1000,
+        "imports": sorted(children, key=lambda item: item[1], reverse=True)
+    }
+
+
+def main(argv: List[str] = None) -> int:
+    """Prints the report and returns a non-zero exit code when a handler exceeds the budget."""
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("handlers", nargs="*", default=HANDLERS)
+    arg_parser.add_argument("--budget-ms", type=float, default=None)
+    arg_parser.add_argument("--top", type=int, default=5)
+    args = arg_parser.parse_args(argv)
+
+    over_budget = []
+    for handler in args.handlers:
+        report = measure_import(handler)
+        print(f"{report['handler']}: {report['total_ms']:.1f} ms")
+        for name, cumulative_ms in report["imports"][:args.top]:
+            print(f"    {cumulative_ms:9.1f} ms  {name}")
+        if args.budget_ms is not None and report["total_ms"] > args.budget_ms:
+            over_budget.append(report["handler"])
+
+    if over_budget:
+        print(f"Over the {args.budget_ms} ms import budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,36 @@
+import unittest
+from unittest.mock import patch, Mock
+from import_time import parse_importtime, measure_import, main
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       216 |        216 |   _io
+import time:       615 |       1384 | _frozen_importlib_external
+import time:      1200 |       1200 |     botocore.compat
+import time:      3000 |     150000 |   boto3
+import time:       800 |       2000 |   logging
+import time:       500 |     152500 | url_generator
+"""
+
+class TestImportTime(unittest.TestCase):
+
+    def test_parse_importtime(self):
+        rows = parse_importtime(IMPORTTIME_OUTPUT)
+        self.assertEqual(rows[0], (1, 216, 216, "_io"))
+        self.assertEqual(rows[2], (2, 1200, 1200, "botocore.compat"))
+        self.assertEqual(rows[-1], (0, 500, 152500, "url_generator"))
+
+    @patch('import_time.subprocess.run')
+    def test_measure_import_reports_direct_imports(self, mock_run):
+        mock_run.return_value = Mock(returncode=0, stderr=IMPORTTIME_OUTPUT)
+        report = measure_import("url_generator_lambda/url_generator.py")
+        self.assertEqual(report["total_ms"], 152.5)
+        self.assertEqual(report["imports"], [("boto3", 150.0), ("logging", 2.0)])
+
+    @patch('import_time.subprocess.run')
+    def test_main_fails_over_budget(self, mock_run):
+        mock_run.return_value = Mock(returncode=0, stderr=IMPORTTIME_OUTPUT)
+        self.assertEqual(main(["url_generator_lambda/url_generator.py", "--budget-ms", "100"]), 1)
+        self.assertEqual(main(["url_generator_lambda/url_generator.py", "--budget-ms", "200"]), 0)
+
+if __name__ == '__main__':
+    unittest.main()
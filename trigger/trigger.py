@@ -4,13 +4,15 @@ import logging
 import os
 import time
 import boto3
+from structured_logging import log
 
 logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger()
 
 
 def lambda_handler(event: dict, context: dict) -> None:
     try:
-        logging.info(f"Event: {event}")
+        log(logger, logging.INFO, "Event", event=event)
 
         year = int(event['year'])
         month = int(event['month'])
@@ -38,7 +40,7 @@ def lambda_handler(event: dict, context: dict) -> None:
 
         payload = {'bucket_name': bucket_name, 'key': keys,
                    'file_date': f'{month:02d}{day:02d}{str(year)[-2]}'}
-        logging.info(f"Payload: {payload}")
+        log(logger, logging.INFO, "Payload", payload=payload)
         execute_step_function(payload)
     except Exception as raised_exception:
         logging.critical(f"Exception: {raised_exception}")
@@ -98,7 +100,8 @@ def query_execution(query: str, query_bucket: str, database: str) -> None:
             time.sleep(5)
         response = athena_client.get_query_results(
             QueryExecutionId=query_execution_id)
-        logging.info(f"Query results: {response}")
+        log(logger, logging.INFO, "Query results", query_execution_id=query_execution_id,
+            rows=len(response.get("ResultSet", {}).get("Rows", [])))
         return query_execution_id
     except Exception as raised_exception:
         logging.critical(f"Exception: {raised_exception}")
@@ -115,7 +118,7 @@ def execute_step_function(file_details: dict) -> None:
         if not response.get('executionArn'):
             logger.critical("Failed to initiate step function")
             raise Exception("Failed to initiate step function")
-        logging.info(f"Step function execution response: {response}")
+        log(logger, logging.INFO, "Step function execution started", execution_arn=response["executionArn"])
         return response
     except Exception as raised_exception:
         logging.critical(f"Exception: {raised_exception}")
@@ -1,9 +1,18 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common", "python"))
 import unittest
 from unittest.mock import patch, Mock, call
+from botocore.exceptions import ClientError
+import url_generator
 from url_generator import lambda_handler
 
 class TestUrlGenerator(unittest.TestCase):
 
+    def setUp(self):
+        url_generator._S3_CLIENT = None
+        url_generator._URL_CACHE.clear()
+
     @patch.dict('os.environ', {'bucket_name': 'test-bucket'})
     @patch('url_generator.boto3.client')
     def test_lambda_handler_valid_event(self, mock_boto_client):
@@ -31,5 +40,38 @@ class TestUrlGenerator(unittest.TestCase):
 
         self.assertIn("Couldn't find file", str(context.exception))
 
+    @patch.dict('os.environ', {'bucket_name': 'test-bucket'})
+    @patch('url_generator.boto3.client')
+    def test_lambda_handler_batch_event(self, mock_boto_client):
+        mock_s3 = Mock()
+        def head_object(Bucket, Key):
+            if 'dd=19' in Key:
+                raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+            return {}
+        mock_s3.head_object.side_effect = head_object
+        mock_s3.generate_presigned_url.side_effect = lambda **kwargs: f"https://signed/{kwargs['Params']['Key']}"
+        mock_boto_client.return_value = mock_s3
+
+        response = lambda_handler({"valDates": ["2023-08-18", "2023-08-19"]}, {})
+
+        self.assertEqual(response["statusCode"], 200)
+        self.assertEqual(list(response["Urls"]), ["2023-08-18"])
+        self.assertEqual(response["Missing"], ["2023-08-19"])
+        mock_boto_client.assert_called_once()
+
+    @patch.dict('os.environ', {'bucket_name': 'test-bucket'})
+    @patch('url_generator.boto3.client')
+    def test_lambda_handler_batch_event_serves_cached_urls(self, mock_boto_client):
+        mock_s3 = Mock()
+        mock_s3.generate_presigned_url.return_value = "https://signed/url"
+        mock_boto_client.return_value = mock_s3
+
+        first = lambda_handler({"valDates": ["2023-08-18"]}, {})
+        second = lambda_handler({"valDates": ["2023-08-18"]}, {})
+
+        self.assertEqual(first["Urls"], second["Urls"])
+        mock_s3.head_object.assert_called_once()
+        mock_s3.generate_presigned_url.assert_called_once()
+
 if __name__ == '__main__':
     unittest.main()
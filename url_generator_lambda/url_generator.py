@@ -1,20 +1,42 @@
 """Lambda for generating URL."""
 import os
+import time
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import boto3
 from botocore.client import Config
+from botocore.exceptions import ClientError
+from structured_logging import log
 
 logging.getLogger().setLevel(logging.INFO)
+logger = logging.getLogger()
+
+URL_EXPIRY_SECONDS = 900
+# Cached URLs are handed out until they have less than this long left to live.
+URL_CACHE_MARGIN_SECONDS = 300
+MAX_WORKERS = 16
+
+# Reused across warm invocations.
+_S3_CLIENT = None
+_URL_CACHE = {}
+_URL_CACHE_LOCK = threading.Lock()
 
 def lambda_handler(event: dict, context: dict) -> dict:
     if event:
-        logging.info("This is the event we received: %s", event)
+        log(logger, logging.INFO, "Event", event=event)
         try:
+            if "valDates" in event:
+                urls = generate_urls(event["valDates"])
+                return {
+                    "statusCode": 200,
+                    "Urls": {file_date: url for file_date, url in urls.items() if url},
+                    "Missing": [file_date for file_date, url in urls.items() if not url]
+                }
             file_date = event["valDate"]
-            file_name = "Purchassetspreads.xlsx"
-            file_key = f"processed/yyy={file_date[:4]}/mm={file_date[5:7]}/dd={file_date[8:]}/{file_name}"
+            file_key = build_file_key(file_date)
             logging.info("This is the file key: %s", file_key)
-            s3_client = boto3.client("s3", config=Config(signature_version="s3v4"))
+            s3_client = get_s3_client()
             
             response = s3_client.list_objects_v2(
                 Bucket=os.environ["bucket_name"],
@@ -24,7 +46,7 @@ def lambda_handler(event: dict, context: dict) -> dict:
                 url = s3_client.generate_presigned_url(
                     ClientMethod="get_object",
                     Params={"Bucket": os.environ["bucket_name"], "Key": file_key},
-                    ExpiresIn=900   
+                    ExpiresIn=URL_EXPIRY_SECONDS
                 )
                 
                 return {"statusCode": 200, "Url": url}
@@ -37,4 +59,53 @@ def lambda_handler(event: dict, context: dict) -> dict:
         
     else:
         logging.error("No event received")
-        raise OSError("No event received")
\ No newline at end of file
+        raise OSError("No event received")
+
+def get_s3_client():
+    """Returns the s3v4 signing client, created once per container."""
+    global _S3_CLIENT
+    if _S3_CLIENT is None:
+        _S3_CLIENT = boto3.client("s3", config=Config(signature_version="s3v4"))
+    return _S3_CLIENT
+
+def build_file_key(file_date: str) -> str:
+    """Builds the key of the workbook for a YYYY-MM-DD valuation date."""
+    file_name = "Purchassetspreads.xlsx"
+    return f"processed/yyy={file_date[:4]}/mm={file_date[5:7]}/dd={file_date[8:]}/{file_name}"
+
+def generate_url(file_key: str):
+    """Returns a presigned URL for the key, or None if the object does not exist.
+
+    URLs are cached for most of their lifetime, so repeated requests skip
+    both the HEAD request and the signing.
+    """
+    now = time.time()
+    cached = _URL_CACHE.get(file_key)
+    if cached and cached[1] - URL_CACHE_MARGIN_SECONDS > now:
+        return cached[0]
+    s3_client = get_s3_client()
+    try:
+        s3_client.head_object(Bucket=os.environ["bucket_name"], Key=file_key)
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+            logging.info("Couldn't find %s", file_key)
+            return None
+        raise error
+    url = s3_client.generate_presigned_url(
+        ClientMethod="get_object",
+        Params={"Bucket": os.environ["bucket_name"], "Key": file_key},
+        ExpiresIn=URL_EXPIRY_SECONDS
+    )
+    with _URL_CACHE_LOCK:
+        for key in [key for key, (_, expires_at) in _URL_CACHE.items() if expires_at <= now]:
+            del _URL_CACHE[key]
+        _URL_CACHE[file_key] = (url, now + URL_EXPIRY_SECONDS)
+    return url
+
+def generate_urls(file_dates: list) -> dict:
+    """Checks and signs the workbooks for many dates concurrently, None for missing ones."""
+    if not file_dates:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(file_dates))) as executor:
+        urls = executor.map(lambda file_date: generate_url(build_file_key(file_date)), file_dates)
+        return dict(zip(file_dates, urls))